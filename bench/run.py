@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+
+from bench.stand_in import StandIn
+from experiment import primelooter, LootOptions
+from queries import registry
+
+COOKIES = (
+    "# Netscape HTTP Cookie File\n"
+    ".amazon.com\tTRUE\t/\tTRUE\t4102444800\tsession-id\tstand-in\n"
+    ".amazon.com\tTRUE\t/\tTRUE\t4102444800\tx-main\tstand-in\n"
+)
+
+
+def run_scenario(size: int, cookie_file: str, args: argparse.Namespace) -> dict:
+    stand_in = StandIn(
+        size,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        persisted_queries=args.stand_in_persisted_queries,
+    )
+    options = LootOptions(
+        claim_concurrency=args.claim_concurrency,
+        claim_rate=args.claim_rate,
+        claim_batch_size=args.claim_batch_size,
+        page_size=args.page_size,
+    )
+
+    # every scenario talks to a fresh stand-in, so the client starts like a fresh process too
+    registry.reset(persisted=args.persisted_queries)
+    tracemalloc.start()
+    started = time.perf_counter()
+    outcomes = asyncio.run(primelooter(cookie_file, stand_in.transport(), options))
+    wall_time = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "offers": size,
+        "wall_time": round(wall_time, 4),
+        "requests": stand_in.requests,
+        "requests_per_second": round(stand_in.requests / wall_time, 1),
+        "upload_kib": round(stand_in.bytes_received / 1024, 1),
+        "peak_memory_kib": peak // 1024,
+        "throttled": stand_in.throttled,
+        "server_errors": stand_in.errors,
+        "outcomes": len(outcomes),
+        "correctness": stand_in.check(),
+    }
+
+
+def compare(previous: dict, results: dict) -> None:
+    # prints the change of every scenario against the last results file with the same configuration
+    if previous.get("config") != results["config"]:
+        print("Previous results used a different configuration, not comparing.")
+        return
+    old_runs = {run["offers"]: run for run in previous.get("runs", [])}
+    for run in results["runs"]:
+        old = old_runs.get(run["offers"])
+        if old is None:
+            continue
+        for key in ("wall_time", "requests_per_second", "upload_kib", "peak_memory_kib"):
+            if old.get(key):
+                change = (run[key] - old[key]) / old[key] * 100
+                print(f"{run['offers']:>6} offers {key:>20}: {old[key]:>12} -> {run[key]:>12} ({change:+.1f}%)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the API claim pipeline against an offline stand-in")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000], help="Catalog sizes to run")
+    parser.add_argument("--latency", type=float, default=0.002, help="Seconds of latency per stand-in request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 503")
+    parser.add_argument("--rate-limit", type=float, default=None, help="Requests per second before a 429")
+    parser.add_argument("--claim-concurrency", type=int, default=50)
+    parser.add_argument("--claim-rate", type=float, default=100000)
+    parser.add_argument("--claim-batch-size", type=int, default=1)
+    parser.add_argument("--page-size", type=int, default=0)
+    parser.add_argument(
+        "--persisted-queries", action="store_true", help="Let the client send automatic persisted queries"
+    )
+    parser.add_argument(
+        "--stand-in-persisted-queries",
+        choices=["supported", "unsupported", "ignored"],
+        default="supported",
+        help="Whether the stand-in supports persisted queries, refuses them or ignores the extension",
+    )
+    parser.add_argument("-o", "--output", default=os.path.join("bench", "results.json"), help="Results file")
+    args = parser.parse_args()
+
+    # per-claim log lines would dominate the timings
+    logging.basicConfig(level=logging.CRITICAL)
+
+    config = {key: value for key, value in vars(args).items() if key not in ("sizes", "output")}
+    results = {"config": config, "python": platform.python_version(), "runs": []}
+    with tempfile.TemporaryDirectory() as directory:
+        cookie_file = os.path.join(directory, "cookies.txt")
+        with open(cookie_file, "w") as f:
+            f.write(COOKIES)
+        for size in args.sizes:
+            run = run_scenario(size, cookie_file, args)
+            results["runs"].append(run)
+            print(json.dumps(run))
+
+    if os.path.exists(args.output):
+        with open(args.output) as f:
+            compare(json.load(f), results)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+        f.write("\n")
@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import json
+import random
+import time
+import typing
+
+import httpx
+
+# every tenth offer of the generated catalog is already claimed, needs an account link or is not claimable at all,
+# everything else is claimable
+CLAIMED, LINK_REQUIRED, NOT_CLAIMABLE = 0, 1, 2
+# what a server without persisted queries answers (with a 400) to a request that only has the hash
+QUERY_REQUIRED = "Query is required"
+
+
+class StandIn:
+    # Offline stand-in for gaming.amazon.com serving the /home csrf page and the GraphQL operations the API path
+    # uses (OffersContext_Offers_And_Items, placeOrdersDetailPage and aliased placeOrders batches), with automatic
+    # persisted queries as set by `persisted_queries`: "supported", "unsupported" (answers PersistedQueryNotSupported)
+    # or "ignored" (drops the extension and wants the query, like a server that never heard of APQ). Latency, random
+    # 503s and 429 throttling above `rate_limit` requests per second are configurable. Every placed order is recorded
+    # so a run can be checked for missing, duplicate and unexpected claims.
+    def __init__(
+        self,
+        catalog_size: int,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit: float = None,
+        seed: int = 0,
+        persisted_queries: str = "supported",
+    ):
+        self.catalog_size = catalog_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.random = random.Random(seed)
+        self.persisted_queries = persisted_queries
+        # documents registered by their sha256 hash
+        self.documents: typing.Dict[str, str] = {}
+        self.requests = 0
+        self.bytes_received = 0
+        self.throttled = 0
+        self.errors = 0
+        self.orders: typing.Dict[str, int] = {}
+        self.window_start = time.monotonic()
+        self.window_requests = 0
+        csrf_input = "<input type='hidden' name='csrf-key' value='stand-in-token' />"
+        self.home_page = (
+            "<html><head>"
+            + "<script></script>" * 2000
+            + csrf_input
+            + "</head><body>"
+            + "<div></div>" * 20000
+            + "</body></html>"
+        )
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    @staticmethod
+    def offer_id(index: int) -> str:
+        return f"amzn1.pg.offer.{index:08d}"
+
+    def item(self, index: int) -> dict:
+        kind = index % 10
+        return {
+            "id": f"amzn1.pg.item.{index:08d}",
+            "offers": [
+                {
+                    "id": self.offer_id(index),
+                    "offerSelfConnection": {
+                        "eligibility": {
+                            "isClaimed": kind == CLAIMED,
+                            "canClaim": kind not in (CLAIMED, LINK_REQUIRED, NOT_CLAIMABLE),
+                            "missingRequiredAccountLink": kind == LINK_REQUIRED,
+                        }
+                    },
+                }
+            ],
+            "game": {
+                "id": f"amzn1.pg.game.{index % 500:05d}",
+                "assets": {"title": f"Game {index}", "publisher": f"Publisher {index % 25}"},
+            },
+        }
+
+    def expected_claims(self) -> typing.Set[str]:
+        return {
+            self.offer_id(index)
+            for index in range(self.catalog_size)
+            if index % 10 not in (CLAIMED, LINK_REQUIRED, NOT_CLAIMABLE)
+        }
+
+    def check(self) -> dict:
+        expected = self.expected_claims()
+        claimed = set(self.orders)
+        return {
+            "missing": len(expected - claimed),
+            "unexpected": len(claimed - expected),
+            "duplicates": sum(count - 1 for count in self.orders.values() if count > 1),
+        }
+
+    def throttle(self) -> bool:
+        if self.rate_limit is None:
+            return False
+        now = time.monotonic()
+        if now - self.window_start >= 1:
+            self.window_start = now
+            self.window_requests = 0
+        self.window_requests += 1
+        return self.window_requests > self.rate_limit
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        self.bytes_received += len(request.content)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if request.url.path == "/home":
+            return httpx.Response(200, text=self.home_page)
+        if self.throttle():
+            self.throttled += 1
+            return httpx.Response(429, headers={"Retry-After": "1"})
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors += 1
+            # load shedding, which tells the client when to come back
+            return httpx.Response(503, headers={"Retry-After": "1"})
+        if request.headers.get("csrf-token") != "stand-in-token":
+            return httpx.Response(403)
+
+        body = json.loads(request.content)
+        error = self.resolve_document(body)
+        if error == QUERY_REQUIRED:
+            return httpx.Response(400, json={"errors": [{"message": error}]})
+        if error is not None:
+            return httpx.Response(200, json={"errors": [{"message": error, "extensions": {"code": error}}]})
+        operation = body.get("operationName")
+        if operation == "OffersContext_Offers_And_Items":
+            return httpx.Response(200, json=self.offers(body["variables"]))
+        if operation and operation.startswith("placeOrders"):
+            return httpx.Response(200, json=self.place_orders(body["variables"]))
+        return httpx.Response(200, json={"errors": [{"message": f"Unknown operation {operation}"}]})
+
+    def resolve_document(self, body: dict) -> typing.Optional[str]:
+        # the error of a request the stand-in can't resolve a document for, like an APQ server would answer it
+        persisted = (body.get("extensions") or {}).get("persistedQuery")
+        if self.persisted_queries == "ignored":
+            return None if body.get("query") else QUERY_REQUIRED
+        if persisted is None:
+            return None if body.get("query") else "GRAPHQL_VALIDATION_FAILED"
+        if self.persisted_queries == "unsupported":
+            return "PERSISTED_QUERY_NOT_SUPPORTED"
+        sha256 = persisted["sha256Hash"]
+        if "query" in body:
+            if hashlib.sha256(body["query"].encode()).hexdigest() != sha256:
+                return "PERSISTED_QUERY_HASH_MISMATCH"
+            self.documents[sha256] = body["query"]
+        elif sha256 not in self.documents:
+            return "PERSISTED_QUERY_NOT_FOUND"
+        return None
+
+    def offers(self, variables: dict) -> dict:
+        page_size = variables.get("pageSize") or self.catalog_size
+        if "after" not in variables:
+            # the one-shot query returns everything, like the real site does with pageSize 999
+            items = [self.item(index) for index in range(self.catalog_size)]
+            return {"data": {"inGameLoot": {"items": items}}}
+
+        start = int(variables["after"] or 0)
+        end = min(start + page_size, self.catalog_size)
+        items = [self.item(index) for index in range(start, end)]
+        page_info = {"hasNextPage": end < self.catalog_size, "endCursor": str(end)}
+        return {"data": {"inGameLoot": {"items": items, "pageInfo": page_info}}}
+
+    def place_orders(self, variables: dict) -> dict:
+        # a single mutation uses `input`, batches alias one mutation per `input<n>` variable as o<n>
+        data = {}
+        for name, order_input in variables.items():
+            alias = "placeOrders" if name == "input" else "o" + name.removeprefix("input")
+            orders = []
+            for offer_id in order_input["offerIds"]:
+                self.orders[offer_id] = self.orders.get(offer_id, 0) + 1
+                orders.append({"catalogOfferId": offer_id, "claimCode": f"CODE-{offer_id[-8:]}"})
+            data[alias] = {"error": None, "orderInformation": orders}
+        return {"data": data}
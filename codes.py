@@ -0,0 +1,112 @@
+import argparse
+import json
+import sqlite3
+import threading
+import time
+import typing
+
+from scheduler import ClaimOutcome, CLAIMED
+
+
+class CodeStore:
+    # Every claim code received, keyed by (account, game, offer). Codes are collected in memory while a run is going
+    # on and written with a single transaction by `flush` (or on close); a key that is already stored is kept as it
+    # is, so claiming or scraping the same code again never adds a duplicate. Safe to fill from several threads.
+    def __init__(self, path: str = "game_codes.db"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.pending: typing.Dict[typing.Tuple[str, str, str], tuple] = {}
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS codes ("
+                "account TEXT NOT NULL, "
+                "game TEXT NOT NULL, "
+                "offer_id TEXT NOT NULL, "
+                "title TEXT, "
+                "code TEXT NOT NULL, "
+                "instructions TEXT, "
+                "claimed_at REAL NOT NULL, "
+                "PRIMARY KEY (account, game, offer_id))"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS codes_by_code ON codes (code)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        self.flush()
+        self.connection.close()
+
+    def add(
+        self, account: str, game: str, offer_id: str, code: str, title: str = None, instructions: str = None
+    ) -> None:
+        with self.lock:
+            self.pending.setdefault((account, game or "", offer_id), (title, code, instructions, time.time()))
+
+    def add_outcomes(self, account: str, outcomes: typing.Iterable[ClaimOutcome]) -> None:
+        for outcome in outcomes:
+            if outcome.status == CLAIMED and outcome.claim_code:
+                self.add(account, outcome.game, outcome.offer_id, outcome.claim_code, outcome.title)
+
+    def flush(self) -> int:
+        # returns how many codes were new
+        with self.lock:
+            rows = [(*key, *value) for key, value in self.pending.items()]
+            self.pending = {}
+            if not rows:
+                return 0
+            before = self.connection.total_changes
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT INTO codes (account, game, offer_id, title, code, instructions, claimed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (account, game, offer_id) DO NOTHING",
+                    rows,
+                )
+            return self.connection.total_changes - before
+
+    def lookup(self, account: str = None, title: str = None, code: str = None, limit: int = None) -> typing.List[dict]:
+        # `account` and `title` match any part of the stored value, `code` has to match exactly
+        conditions, parameters = [], []
+        if account:
+            conditions.append("account LIKE ?")
+            parameters.append(f"%{account}%")
+        if title:
+            conditions.append("(title LIKE ? OR game LIKE ?)")
+            parameters += [f"%{title}%", f"%{title}%"]
+        if code:
+            conditions.append("code = ?")
+            parameters.append(code)
+
+        query = "SELECT account, game, offer_id, title, code, instructions, claimed_at FROM codes"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY claimed_at DESC"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        columns = ("account", "game", "offer_id", "title", "code", "instructions", "claimed_at")
+        return [dict(zip(columns, row)) for row in self.connection.execute(query, parameters)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Look up claim codes collected by Prime Looter")
+    parser.add_argument("--db", default="game_codes.db", help="Path to the code store")
+    parser.add_argument("-a", "--account", help="Only codes of accounts (cookie file paths) containing this")
+    parser.add_argument("-t", "--title", help="Only codes whose title or game contains this")
+    parser.add_argument("-c", "--code", help="Find the offer a code belongs to")
+    parser.add_argument("-n", "--limit", type=int, default=None, help="Show at most this many codes")
+    parser.add_argument("--json", action="store_true", help="Print JSON lines instead of a table")
+    args = parser.parse_args()
+
+    with CodeStore(args.db) as store:
+        rows = store.lookup(args.account, args.title, args.code, args.limit)
+    for row in rows:
+        if args.json:
+            print(json.dumps(row))
+            continue
+        claimed_at = time.strftime("%Y-%m-%d %H:%M", time.localtime(row["claimed_at"]))
+        print(f"{claimed_at}  {row['title'] or row['offer_id']}: {row['code']}  ({row['account']})")
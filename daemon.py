@@ -0,0 +1,80 @@
+import logging
+import random
+import time
+import traceback
+import typing
+
+log = logging.getLogger()
+
+
+class LootDaemon:
+    # Long running replacement for "loot, then sleep 24 hours". Every `interval` seconds (+/- `jitter`) a cheap
+    # fingerprint of the current offers is taken and a full claim pass only runs when it changed, or when the last
+    # full pass is older than `full_pass_interval` so eligibility changes (e.g. newly linked accounts) get picked up.
+    def __init__(
+        self,
+        run_pass: typing.Callable[[], None],
+        fingerprint: typing.Callable[[], str],
+        interval: float = 900,
+        jitter: float = 0.2,
+        full_pass_interval: float = 60 * 60 * 24,
+        fatal_exceptions: typing.Tuple[typing.Type[BaseException], ...] = (),
+    ):
+        self.run_pass = run_pass
+        self.fingerprint = fingerprint
+        self.interval = interval
+        self.jitter = jitter
+        self.full_pass_interval = full_pass_interval
+        self.fatal_exceptions = fatal_exceptions
+        self.last_fingerprint = None
+        self.last_full_pass = None
+
+    def next_delay(self) -> float:
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def pass_due(self, fingerprint: typing.Optional[str]) -> bool:
+        if self.last_full_pass is None or time.monotonic() - self.last_full_pass >= self.full_pass_interval:
+            return True
+        # a failed probe doesn't warrant a full pass on its own, the next tick will try again. Neither does the first
+        # fingerprint after one failed, there is nothing known to compare it with
+        return self.changed(fingerprint)
+
+    def changed(self, fingerprint: typing.Optional[str]) -> bool:
+        return None not in (fingerprint, self.last_fingerprint) and fingerprint != self.last_fingerprint
+
+    def tick(self) -> None:
+        try:
+            fingerprint = self.fingerprint()
+        except self.fatal_exceptions:
+            raise
+        except Exception as ex:
+            log.warning(f"Could not check for new offers: {ex}")
+            fingerprint = None
+
+        if not self.pass_due(fingerprint):
+            log.debug("No new offers")
+            if self.last_fingerprint is None:
+                self.last_fingerprint = fingerprint
+            return
+
+        if self.last_full_pass is not None and self.changed(fingerprint):
+            log.info("Offers changed, starting a claim pass")
+        try:
+            self.run_pass()
+        except self.fatal_exceptions:
+            raise
+        except Exception as ex:
+            # the fingerprint is left alone so the next tick retries the pass
+            log.error(ex)
+            traceback.print_tb(ex.__traceback__)
+            return
+        if fingerprint is not None:
+            self.last_fingerprint = fingerprint
+        self.last_full_pass = time.monotonic()
+
+    def run_forever(self) -> None:
+        while True:
+            self.tick()
+            delay = self.next_delay()
+            log.debug(f"Next check for new offers in {delay / 60:.1f} minutes")
+            time.sleep(delay)
@@ -1,71 +1,535 @@
+import dataclasses
+import hashlib
 import httpx
-import json
 import asyncio
-import re
 import logging
+import os
+import time
+import typing
 import http.cookiejar as cookiejar
+from codes import CodeStore
+from ledger import ClaimLedger
+from logs import log_account
+from metrics import metrics
+from session import SessionCache, fetch_csrf_token
+from filters import OfferFilter
+from offers import Offer, classify
+from profiling import profiler
+from queries import registry, persisted_query_error, offers_request, fingerprint_request, GraphQLRequest
+from scheduler import (
+    ClaimScheduler,
+    ClaimOutcome,
+    Deadline,
+    DeadlineExceeded,
+    RequestFailed,
+    turned_away,
+    summarize,
+    RETRY_STATUS_CODES,
+    CLAIMED,
+    ALREADY_CLAIMED,
+    LINK_REQUIRED,
+    NOT_CLAIMABLE,
+    FILTERED,
+    FAILED,
+)
 
 gql_url = "https://gaming.amazon.com/graphql"
 
 logging.getLogger("httpx").setLevel(logging.WARNING)
 log = logging.getLogger()
-offers_payload = {
-    "operationName": "OffersContext_Offers_And_Items",
-    "variables": {"pageSize": 999},
-    "extensions": {},
-    "query": "query OffersContext_Offers_And_Items($dateOverride: Time, $pageSize: Int) {\n  inGameLoot: items(\n    collectionType: LOOT\n    dateOverride: $dateOverride\n    pageSize: $pageSize\n  ) {\n    items {\n      ...Item\n      __typename\n    }\n    __typename\n  }\n}\n\nfragment Item on Item {\n  id\n  isDirectEntitlement\n  requiresLinkBeforeClaim\n  grantsCode\n  isDeepLink\n  isFGWP\n  offers {\n    ...Item_Offer\n    __typename\n  }\n  game {\n    ...Game\n    __typename\n  }\n  __typename\n}\n\n\nfragment Item_Offer on Offer {\n  id\n  offerSelfConnection {\n    eligibility {\n      ...Item_Offer_Eligibility\n      __typename\n    }\n    __typename\n  }\n  __typename\n}\n\nfragment Item_Offer_Eligibility on OfferEligibility {\n  isClaimed\n  canClaim\n  missingRequiredAccountLink\n}\n\nfragment Game on GameV2 {\n  id\n  assets {\n    title\n    publisher\n  }\n}\n",  # noqa: E501 TODO: This needs to become a non \n formatted string somewhere, just not doing it now
+base_headers = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/117.0",
 }
 
 
-async def claim_offer(offer_id: str, item: dict, client: httpx.AsyncClient, headers: dict) -> True:
-    if not item["offers"][0]["offerSelfConnection"]["eligibility"]["isClaimed"]:
-        if (
-            item["offers"][0]["offerSelfConnection"]["eligibility"]["canClaim"] is False
-            and item["offers"][0]["offerSelfConnection"]["eligibility"]["missingRequiredAccountLink"] is True
-        ):
-            log.error(f"Cannot collect game `{item['game']['assets']['title']}`, account link required.")
-            return
-        log.info(f"Collecting offer for {item['game']['assets']['title']}")
-        claim_payload = {
-            "operationName": "placeOrdersDetailPage",
-            "variables": {
-                "input": {
-                    "offerIds": [offer_id],
-                    "attributionChannel": '{"eventId":"ItemDetailRootPage:' + offer_id + '","page":"ItemDetailPage"}',
-                }
-            },
-            "extensions": {},
-            "query": "fragment Place_Orders_Payload_Order_Information on OfferOrderInformation {\n  catalogOfferId\n  claimCode\n  entitledAccountId\n  entitledAccountName\n  id\n  orderDate\n  orderState\n  __typename\n}\n\nmutation placeOrdersDetailPage($input: PlaceOrdersInput!) {\n  placeOrders(input: $input) {\n    error {\n      code\n      __typename\n    }\n    orderInformation {\n      ...Place_Orders_Payload_Order_Information\n      __typename\n    }\n    __typename\n  }\n}\n",  # noqa: E501 TODO: This needs to become a non \n formatted string somewhere, just not doing it now
-        }
+@dataclasses.dataclass
+class LootOptions:
+    claim_concurrency: int = 5
+    claim_rate: float = 2.0
+    claim_batch_size: int = 1
+    ledger_path: typing.Optional[str] = None
+    code_store_path: typing.Optional[str] = None
+    # offers it doesn't want are never claimed, None claims everything
+    offer_filter: typing.Optional[OfferFilter] = None
+    session_cache: typing.Optional[SessionCache] = None
+    # 0 fetches every offer with a single request
+    page_size: int = 0
+    # seconds a single request may take, and the whole run of an account (None for no limit)
+    request_timeout: float = 30.0
+    run_deadline: typing.Optional[float] = None
+    # how often claims that failed on the request level are tried again at the end of the run
+    claim_retry_rounds: int = 1
+
+    def scheduler(self) -> ClaimScheduler:
+        # one per account and run, the deadline starts counting when it is created
+        return ClaimScheduler(
+            max_concurrency=self.claim_concurrency,
+            rate=self.claim_rate,
+            request_timeout=self.request_timeout,
+            deadline=Deadline(self.run_deadline),
+        )
+
+
+def attribution_channel(offer_id: str) -> str:
+    return '{"eventId":"ItemDetailRootPage:' + offer_id + '","page":"ItemDetailPage"}'
+
+
+def place_orders_outcome(offer: Offer, place_orders: dict, attempts: int) -> ClaimOutcome:
+    if place_orders is None:
+        log.error(f"Error: no placeOrders result for `{offer.title}`")
+        return ClaimOutcome(offer.id, offer.title, FAILED, "missing placeOrders result", attempts, game=offer.game_id)
+    if place_orders["error"] is not None:
+        log.error(f"Error: {place_orders['error']}")
+        return ClaimOutcome(offer.id, offer.title, FAILED, str(place_orders["error"]), attempts, game=offer.game_id)
+
+    claim_code = None
+    for order in place_orders.get("orderInformation") or []:
+        if order.get("catalogOfferId") in (None, offer.id):
+            claim_code = order.get("claimCode") or claim_code
+    return ClaimOutcome(offer.id, offer.title, CLAIMED, attempts=attempts, claim_code=claim_code, game=offer.game_id)
+
+
+def offers_page_request(page_size: int, cursor: str = None) -> GraphQLRequest:
+    return registry.offers_page.request({"pageSize": page_size, "after": cursor})
+
+
+async def send_graphql(client: httpx.AsyncClient, headers: dict, body: bytes, phase: str) -> httpx.Response:
+    with metrics.phase(phase):
+        response = await client.post(gql_url, headers=headers, content=body)
+    metrics.count_bytes(phase, sent=len(body), received=len(response.content))
+    return response
+
+
+async def post_graphql(
+    client: httpx.AsyncClient, headers: dict, request: GraphQLRequest, phase: str
+) -> httpx.Response:
+    # Automatic persisted queries: the first request of an operation sends its document along with the hash, after
+    # that the hash alone is enough. When the server lost the hash the document is sent again, when it can't handle
+    # persisted queries at all every request of the process goes back to sending the plain document. Only those
+    # answers lead to a second request, a server sends them before executing anything, so a claim can't be placed
+    # twice this way. Any other error is the result of the request.
+    if not registry.persisted:
+        return await send_graphql(client, headers, request.body("plain"), phase)
+    operation = request.operation
+    if not registry.confirmed:
+        if not operation.read_only:
+            # a claim never finds out whether the server supports persisted queries
+            return await send_graphql(client, headers, request.body("plain"), phase)
+        return await probe_persisted_queries(client, headers, request, phase)
+
+    form = "hash" if operation.registered else "register"
+    response = await send_graphql(client, headers, request.body(form), phase)
+    error = persisted_query_error(response.status_code, response.content)
+    if error is None:
+        operation.registered = operation.registered or response.status_code == 200
+        return response
+    if error == "not_found" and form == "hash":
+        operation.registered = False
+        return await send_graphql(client, headers, request.body("register"), phase)
+    return await stop_persisting(client, headers, request, phase)
+
+
+async def probe_persisted_queries(
+    client: httpx.AsyncClient, headers: dict, request: GraphQLRequest, phase: str
+) -> httpx.Response:
+    # A read sends the hash alone. A server with persisted queries either doesn't know the hash yet or answers with
+    # data, every other answer without data (a server ignoring the extension wants the query) means plain documents.
+    response = await send_graphql(client, headers, request.body("hash"), phase)
+    if response.status_code in RETRY_STATUS_CODES:
+        # nothing learned, the read is retried and probes again
+        return response
+    if persisted_query_error(response.status_code, response.content) == "not_found":
+        registry.confirmed = True
+        return await post_graphql(client, headers, request, phase)
+    if response.status_code == 200 and not missing_data(response):
+        registry.confirmed = True
+        request.operation.registered = True
+        return response
+    return await stop_persisting(client, headers, request, phase)
+
+
+async def stop_persisting(
+    client: httpx.AsyncClient, headers: dict, request: GraphQLRequest, phase: str
+) -> httpx.Response:
+    # only a plain document that went through proves the persisted one was the problem
+    response = await send_graphql(client, headers, request.body("plain"), phase)
+    if response.status_code == 200 and persisted_query_error(response.status_code, response.content) is None:
+        log.debug("The server doesn't support persisted queries, sending the full documents from now on")
+        registry.persisted = False
+    return response
+
+
+async def fetch_graphql(
+    client: httpx.AsyncClient, headers: dict, request: GraphQLRequest, scheduler: ClaimScheduler
+) -> httpx.Response:
+    # offer queries are read only, so they can safely be retried when the server has a hiccup
+    async def fetch():
+        response = await post_graphql(client, headers, request, "offers")
+        if response.status_code in RETRY_STATUS_CODES:
+            response.raise_for_status()
+        return response
+
+    return await scheduler.fetch(fetch)
+
+
+async def fetch_csrf(client: httpx.AsyncClient, scheduler: ClaimScheduler) -> str:
+    with profiler.phase("csrf"):
+        return await scheduler.fetch(lambda: fetch_csrf_token(client, base_headers))
+
+
+async def send_claim(
+    request: GraphQLRequest, client: httpx.AsyncClient, headers: dict, scheduler: ClaimScheduler
+) -> typing.Tuple[typing.Optional[dict], typing.Optional[str], int, bool]:
+    # returns the response data, or an error message if the whole request failed, plus the attempts it took and
+    # whether the failure was transient: the request never reached the server or was turned away (429, 503 with
+    # Retry-After).
+    # a rejected request (4xx, GraphQL errors) or one that may have been processed is not worth sending again.
+    try:
+        response, attempts = await scheduler.request(lambda: post_graphql(client, headers, request, "claim"))
+    except RequestFailed as ex:
+        return None, str(ex), ex.attempts, not ex.sent
+    except DeadlineExceeded as ex:
+        return None, str(ex), 0, True
+    if response.status_code != 200:
+        return None, f"HTTP {response.status_code}", attempts, turned_away(response)
+
+    payload = response.json()
+    if not payload.get("data"):
+        return None, str(payload.get("errors")), attempts, False
+    return payload["data"], None, attempts, False
+
+
+def log_outcomes(outcomes: typing.List[ClaimOutcome], started: float) -> None:
+    duration = round(time.perf_counter() - started, 3)
+    for outcome in outcomes:
+        extra = {"offer_id": outcome.offer_id, "status": outcome.status, "attempts": outcome.attempts}
+        log.debug(f"`{outcome.title}`: {outcome.status} after {duration}s", extra=extra | {"duration": duration})
+
+
+async def claim_offer(
+    offer: Offer, client: httpx.AsyncClient, headers: dict, scheduler: ClaimScheduler
+) -> ClaimOutcome:
+    log.info(f"Collecting offer for {offer.title}", extra={"offer_id": offer.id})
+    started = time.perf_counter()
+    request = registry.place_orders.request(
+        {"input": {"offerIds": [offer.id], "attributionChannel": attribution_channel(offer.id)}}
+    )
 
-        response = await client.post(gql_url, headers=headers, data=json.dumps(claim_payload))
-        if response.json()["data"]["placeOrders"]["error"] is not None:
-            log.error(f"Error: {response.json()['data']['placeOrders']['error']}")
+    data, error, attempts, transient = await send_claim(request, client, headers, scheduler)
+    if error is not None:
+        log.error(f"Error: could not collect `{offer.title}`: {error}", extra={"offer_id": offer.id})
+        outcome = ClaimOutcome(offer.id, offer.title, FAILED, error, attempts, retryable=transient, game=offer.game_id)
+    else:
+        outcome = place_orders_outcome(offer, data.get("placeOrders"), attempts)
+    log_outcomes([outcome], started)
+    return outcome
 
 
-async def primelooter(cookie_file):
-    jar = cookiejar.MozillaCookieJar(cookie_file)
-    jar.load()
-    async with httpx.AsyncClient() as client:
-        base_headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/117.0",
+async def claim_offers_batch(
+    offers: typing.List[Offer], client: httpx.AsyncClient, headers: dict, scheduler: ClaimScheduler
+) -> typing.List[ClaimOutcome]:
+    # claims several offers with one request by giving every offer its own aliased placeOrders mutation, the alias
+    # is what maps each result (and its error) back to the offer it belongs to.
+    log.info(f"Collecting offers for {', '.join(offer.title for offer in offers)}")
+    started = time.perf_counter()
+
+    request = registry.place_orders_batch(len(offers)).request(
+        {
+            f"input{i}": {"offerIds": [offer.id], "attributionChannel": attribution_channel(offer.id)}
+            for i, offer in enumerate(offers)
         }
+    )
+
+    data, error, attempts, transient = await send_claim(request, client, headers, scheduler)
+    if error is not None:
+        log.error(f"Error: could not collect {', '.join(offer.title for offer in offers)}: {error}")
+        outcomes = [
+            ClaimOutcome(offer.id, offer.title, FAILED, error, attempts, retryable=transient, game=offer.game_id)
+            for offer in offers
+        ]
+    else:
+        outcomes = [place_orders_outcome(offer, data.get(f"o{i}"), attempts) for i, offer in enumerate(offers)]
+    log_outcomes(outcomes, started)
+    return outcomes
+
+
+async def claim_items(
+    offers: typing.List[Offer],
+    client: httpx.AsyncClient,
+    headers: dict,
+    scheduler: ClaimScheduler,
+    batch_size: int = 1,
+    offer_filter: OfferFilter = None,
+) -> typing.List[ClaimOutcome]:
+    buckets = classify(offers)
+    outcomes = [ClaimOutcome(offer.id, offer.title, ALREADY_CLAIMED) for offer in buckets.claimed]
+    for offer in buckets.needs_link:
+        log.error(f"Cannot collect game `{offer.title}`, account link required.")
+        outcomes.append(ClaimOutcome(offer.id, offer.title, LINK_REQUIRED))
+    for offer in buckets.not_claimable:
+        log.debug(f"Cannot collect game `{offer.title}`, the offer is not claimable.")
+        outcomes.append(ClaimOutcome(offer.id, offer.title, NOT_CLAIMABLE))
+
+    claimable = buckets.claimable
+    if offer_filter is not None:
+        claimable, unwanted = offer_filter.split(claimable)
+        for offer in unwanted:
+            log.debug(f"Skipping `{offer.title}` from {offer.publisher}, filtered out by the publisher rules.")
+            outcomes.append(ClaimOutcome(offer.id, offer.title, FILTERED, game=offer.game_id))
+    outcomes.extend(await claim_all(claimable, client, headers, scheduler, batch_size))
+    return outcomes
+
+
+async def claim_all(
+    offers: typing.List[Offer],
+    client: httpx.AsyncClient,
+    headers: dict,
+    scheduler: ClaimScheduler,
+    batch_size: int = 1,
+) -> typing.List[ClaimOutcome]:
+    # every claim is started right away, the scheduler decides how many of them are in flight and how fast
+    if batch_size <= 1:
+        return await asyncio.gather(*[claim_offer(offer, client, headers, scheduler) for offer in offers])
+
+    chunks = []
+    for start in range(0, len(offers), batch_size):
+        end = start + batch_size
+        chunks.append(offers[start:end])
+    outcomes = []
+    for chunk_outcomes in await asyncio.gather(
+        *[claim_offers_batch(chunk, client, headers, scheduler) for chunk in chunks]
+    ):
+        outcomes.extend(chunk_outcomes)
+    return outcomes
 
-        json_headers = base_headers | {
-            "Content-Type": "application/json",
+
+async def retry_failed_claims(
+    outcomes: typing.List[ClaimOutcome],
+    client: httpx.AsyncClient,
+    headers: dict,
+    scheduler: ClaimScheduler,
+    rounds: int = 1,
+    batch_size: int = 1,
+) -> typing.List[ClaimOutcome]:
+    # claims whose request failed are tried again once everything else is done, instead of starting the whole run
+    # over. outcomes that didn't fail on the request level are returned untouched.
+    for retry_round in range(1, rounds + 1):
+        failed = [outcome for outcome in outcomes if outcome.retryable]
+        if not failed or scheduler.deadline.remaining() <= 0:
+            break
+        log.info(f"Retrying {len(failed)} failed claims (round {retry_round} of {rounds})")
+        offers = [Offer(outcome.offer_id, outcome.title, game_id=outcome.game) for outcome in failed]
+        retried = {
+            outcome.offer_id: outcome for outcome in await claim_all(offers, client, headers, scheduler, batch_size)
         }
-        for _c in jar:
+        outcomes = [retried.get(outcome.offer_id, outcome) for outcome in outcomes]
+    return outcomes
+
+
+async def offer_pages(
+    client: httpx.AsyncClient, headers: dict, response: httpx.Response, page_size: int, scheduler: ClaimScheduler
+) -> typing.AsyncIterator[typing.List[Offer]]:
+    # yields the items of the already fetched first response, then follows the cursor page by page when paginating.
+    # only one page is held in memory at a time.
+    while True:
+        with profiler.phase("decode"):
+            loot = response.json()["data"]["inGameLoot"]
+            offers = [Offer.from_item(item) for item in loot["items"]]
+        yield offers
+        page_info = loot.get("pageInfo")
+        if not page_size or not page_info or not page_info["hasNextPage"]:
+            return
+        request = offers_page_request(page_size, page_info["endCursor"])
+        response = await fetch_graphql(client, headers, request, scheduler)
+
+
+async def claim_pages(
+    pages: typing.AsyncIterator[typing.List[Offer]],
+    settled: typing.Set[str],
+    client: httpx.AsyncClient,
+    headers: dict,
+    scheduler: ClaimScheduler,
+    batch_size: int = 1,
+    offer_filter: OfferFilter = None,
+) -> typing.Tuple[typing.List[ClaimOutcome], typing.Optional[Exception]]:
+    # claims for a page are started as soon as it arrives, while the next page is still being downloaded. when a
+    # page can't be fetched the claims already started still run to the end, the error is returned alongside them.
+    tasks = []
+    error = None
+    try:
+        async for offers in pages:
+            unsettled = [offer for offer in offers if offer.id not in settled]
+            if len(unsettled) != len(offers):
+                log.debug(f"Skipping {len(offers) - len(unsettled)} offers settled in an earlier run")
+            tasks.append(
+                asyncio.create_task(claim_items(unsettled, client, headers, scheduler, batch_size, offer_filter))
+            )
+    except Exception as ex:
+        log.error(f"Could not fetch all offers: {ex!r}")
+        error = ex
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    outcomes = [outcome for page_outcomes in await asyncio.gather(*tasks) for outcome in page_outcomes]
+    return outcomes, error
+
+
+def missing_data(response: httpx.Response) -> bool:
+    # only a response with errors is decoded here, a full offers response is left for offer_pages to decode once
+    if b'"errors"' not in response.content:
+        return b'"data"' not in response.content
+    return not response.json().get("data")
+
+
+def csrf_rejected(response: httpx.Response) -> bool:
+    if response.status_code in (401, 403):
+        return True
+    return response.status_code == 200 and missing_data(response)
+
+
+def open_client(
+    cookie_file: str, transport: httpx.AsyncBaseTransport = None, session: SessionCache = None, timeout: float = 30.0
+) -> httpx.AsyncClient:
+    # every account gets its own client (and with it its own cookie jar), but when a shared transport is passed in
+    # the connection pool is owned by the caller, so the client must only be closed when no transport was given.
+    with profiler.phase("cookies"):
+        cookies = session.cookies(os.path.abspath(cookie_file), cookie_file) if session is not None else None
+        if cookies is None:
+            cookies = cookiejar.MozillaCookieJar(cookie_file)
+            cookies.load()
+
+        client = httpx.AsyncClient(transport=transport, timeout=timeout)
+        for _c in cookies:
             client.cookies.jar.set_cookie(_c)
+    return client
+
+
+async def post_with_csrf(
+    client: httpx.AsyncClient,
+    cookie_file: str,
+    request: GraphQLRequest,
+    scheduler: ClaimScheduler,
+    session: SessionCache = None,
+) -> typing.Tuple[httpx.Response, dict]:
+    # sends the first GraphQL request of a run and returns its response together with the headers (csrf token
+    # included) to use for the rest of the run. a cached token is tried first and replaced if it gets rejected.
+    account = os.path.abspath(cookie_file)
+    json_headers = base_headers | {
+        "Content-Type": "application/json",
+    }
+    csrf_token = session.token(account) if session is not None else None
+    json_headers["csrf-token"] = csrf_token or await fetch_csrf(client, scheduler)
+
+    with profiler.phase("offers"):
+        response = await fetch_graphql(client, json_headers, request, scheduler)
+    if csrf_token and csrf_rejected(response):
+        log.debug("Cached csrf token was rejected, fetching a new one")
+        session.invalidate(account)
+        json_headers["csrf-token"] = await fetch_csrf(client, scheduler)
+        with profiler.phase("offers"):
+            response = await fetch_graphql(client, json_headers, request, scheduler)
+    if session is not None:
+        session.store(account, cookie_file, json_headers["csrf-token"], client.cookies.jar)
+    return response, json_headers
 
-        html_body = (await client.get("https://gaming.amazon.com/home", headers=base_headers)).text
-        matches = re.findall(r"name='csrf-key' value='(.*)'", html_body)
-        json_headers["csrf-token"] = matches[0]
 
-        response = await client.post(gql_url, headers=json_headers, data=json.dumps(offers_payload))
-        data = response.json()["data"]["inGameLoot"]["items"]
+async def offers_fingerprint(
+    cookie_file, transport: httpx.AsyncBaseTransport = None, options: LootOptions = None
+) -> str:
+    # cheap check for new loot: only asks for the offer ids and hashes them
+    options = options or LootOptions()
+    client = open_client(cookie_file, transport, options.session_cache, options.request_timeout)
+    try:
+        response, _ = await post_with_csrf(
+            client, cookie_file, fingerprint_request, options.scheduler(), options.session_cache
+        )
+        items = response.json()["data"]["inGameLoot"]["items"]
+    finally:
+        if transport is None:
+            await client.aclose()
+    offer_ids = sorted(offer["id"] for item in items for offer in item["offers"])
+    return hashlib.sha256("\n".join(offer_ids).encode()).hexdigest()
+
 
-        # although insanely low, python WILL garbage collect running coroutines if their references
-        # aren't stored somewhere, therefore we noqa the Flake8 issue yelling at us about it.
-        coros = await asyncio.gather(  # noqa: F841
-            *[claim_offer(item["offers"][0]["id"], item, client, json_headers) for item in data]
+async def primelooter(
+    cookie_file, transport: httpx.AsyncBaseTransport = None, options: LootOptions = None
+) -> typing.List[ClaimOutcome]:
+    options = options or LootOptions()
+    account = os.path.abspath(cookie_file)
+    # every account runs in its own task, so this only tags the log records of this account
+    log_account.set(account)
+    client = open_client(cookie_file, transport, options.session_cache, options.request_timeout)
+    ledger = ClaimLedger(options.ledger_path) if options.ledger_path else None
+    started = time.perf_counter()
+    try:
+        scheduler = options.scheduler()
+        page_size = options.page_size
+        first_request = offers_page_request(page_size) if page_size else offers_request
+        response, json_headers = await post_with_csrf(
+            client, cookie_file, first_request, scheduler, options.session_cache
         )
+        # servers that don't know the `after` argument answer with a 400 or with errors instead of data
+        if page_size and (not response.is_success or missing_data(response)):
+            log.warning("Paginated offers query was refused, falling back to fetching all offers at once")
+            page_size = 0
+            response = await fetch_graphql(client, json_headers, offers_request, scheduler)
+
+        settled = ledger.settled(account) if ledger is not None else set()
+        pages = offer_pages(client, json_headers, response, page_size, scheduler)
+        batch_size = options.claim_batch_size
+        with profiler.phase("claims"):
+            outcomes, error = await claim_pages(
+                pages, settled, client, json_headers, scheduler, batch_size, options.offer_filter
+            )
+            outcomes = await retry_failed_claims(
+                outcomes, client, json_headers, scheduler, options.claim_retry_rounds, batch_size
+            )
+        duration = round(time.perf_counter() - started, 3)
+        log.info(f"Claim results: {summarize(outcomes)}", extra={"duration": duration, "phase": "account"})
+        metrics.count_outcomes(outcomes)
+        if ledger is not None:
+            ledger.record(account, outcomes)
+        if options.code_store_path:
+            with CodeStore(options.code_store_path) as code_store:
+                code_store.add_outcomes(account, outcomes)
+        if error is not None:
+            # the claims that were made are recorded, the account still counts as failed
+            raise error
+        return outcomes
+    finally:
+        metrics.observe("account", time.perf_counter() - started)
+        if ledger is not None:
+            ledger.close()
+        if transport is None:
+            await client.aclose()
+
+
+async def primelooter_fleet(
+    cookie_files: typing.List[str],
+    max_concurrency: int = 4,
+    transport: httpx.AsyncBaseTransport = None,
+    options: LootOptions = None,
+) -> typing.Dict[str, Exception]:
+    # loots several accounts in one event loop over a shared connection pool, at most `max_concurrency` at a time.
+    # returns the exceptions of the accounts that failed, keyed by cookie file.
+    semaphore = asyncio.Semaphore(max_concurrency)
+    failures = {}
+
+    async def run_account(cookie_file):
+        async with semaphore:
+            log.info(f"Looting account {cookie_file}")
+            try:
+                await primelooter(cookie_file, transport, options)
+            except Exception as ex:
+                log.error(f"Account {cookie_file} failed: {ex}")
+                failures[cookie_file] = ex
+
+    if transport is not None:
+        await asyncio.gather(*[run_account(cookie_file) for cookie_file in cookie_files])
+        return failures
+
+    limits = httpx.Limits(max_connections=max_concurrency * 10, max_keepalive_connections=max_concurrency * 2)
+    async with httpx.AsyncHTTPTransport(limits=limits) as transport:
+        await asyncio.gather(*[run_account(cookie_file) for cookie_file in cookie_files])
+    return failures
@@ -0,0 +1,82 @@
+import fnmatch
+import re
+import typing
+
+from offers import Offer
+
+FIELDS = ("publisher", "title", "game")
+
+
+class FieldMatcher:
+    # every rule is an exact value in a set, the ones with wildcards also go into one combined regex. The set is
+    # checked first so a name like `Foo [JP]` still matches itself. Both compare case-insensitively.
+    __slots__ = ("values", "pattern")
+
+    def __init__(self, rules: typing.Iterable[str]):
+        rules = list(rules)
+        self.values = {rule.casefold() for rule in rules}
+        patterns = [fnmatch.translate(rule) for rule in rules if any(char in rule for char in "*?[")]
+        self.pattern = re.compile("|".join(patterns), re.IGNORECASE) if patterns else None
+
+    def __bool__(self):
+        return bool(self.values) or self.pattern is not None
+
+    def matches(self, value: typing.Optional[str]) -> bool:
+        if value is None:
+            return False
+        return value.casefold() in self.values or (self.pattern is not None and self.pattern.match(value) is not None)
+
+
+class OfferFilter:
+    # Include/exclude rules for offers, compiled once from the lines of publishers.txt:
+    #   Some Publisher        include offers of this publisher (a line without a field is a publisher)
+    #   title:Some Game       include offers with this title
+    #   game:amzn1.pg.game.x  include offers of this game id
+    #   !publisher:Other*     exclude offers matching the rule, excludes always win over includes
+    #   all                   include everything that isn't excluded
+    # Values are compared case-insensitively and may use * and ? wildcards. Empty lines, comments (#) and separator
+    # lines (---) are ignored. Rules that only exclude include everything else, no rules at all include nothing (like
+    # an empty publishers.txt always did).
+    def __init__(self, includes: typing.Dict[str, typing.List[str]], excludes: typing.Dict[str, typing.List[str]]):
+        self.includes = {field: FieldMatcher(includes.get(field, [])) for field in FIELDS}
+        self.excludes = {field: FieldMatcher(excludes.get(field, [])) for field in FIELDS}
+        only_excludes = any(self.excludes.values()) and not any(self.includes.values())
+        self.include_all = "all" in includes.get("publisher", []) or only_excludes
+
+    @classmethod
+    def from_lines(cls, lines: typing.Iterable[str]) -> "OfferFilter":
+        includes: typing.Dict[str, typing.List[str]] = {}
+        excludes: typing.Dict[str, typing.List[str]] = {}
+        for line in lines:
+            rule = line.strip()
+            if not rule or rule.startswith("#") or set(rule) == {"-"}:
+                continue
+            rules = includes
+            if rule.startswith("!"):
+                rules = excludes
+                rule = rule[1:].strip()
+            field, _, value = rule.partition(":")
+            if field.strip() in FIELDS and value.strip():
+                field, rule = field.strip(), value.strip()
+            else:
+                field = "publisher"
+            rules.setdefault(field, []).append(rule)
+        return cls(includes, excludes)
+
+    @classmethod
+    def from_file(cls, path: str) -> "OfferFilter":
+        with open(path) as f:
+            return cls.from_lines(f)
+
+    def wanted(self, offer: Offer) -> bool:
+        values = (("publisher", offer.publisher), ("title", offer.title), ("game", offer.game_id))
+        if any(self.excludes[field].matches(value) for field, value in values):
+            return False
+        return self.include_all or any(self.includes[field].matches(value) for field, value in values)
+
+    def split(self, offers: typing.Iterable[Offer]) -> typing.Tuple[typing.List[Offer], typing.List[Offer]]:
+        # (wanted, unwanted)
+        wanted, unwanted = [], []
+        for offer in offers:
+            (wanted if self.wanted(offer) else unwanted).append(offer)
+        return wanted, unwanted
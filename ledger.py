@@ -0,0 +1,61 @@
+import sqlite3
+import time
+import typing
+
+from scheduler import ClaimOutcome, CLAIMED, ALREADY_CLAIMED
+
+# offers in one of these states are never looked at again for the same account
+FINAL_STATES = (CLAIMED, ALREADY_CLAIMED)
+
+
+class ClaimLedger:
+    # On-disk record of every offer seen per account, keyed by (account, offer id). Reads happen once per run before
+    # any claim work and writes are collected into a single transaction at the end of the run.
+    def __init__(self, path: str = "primelooter.db"):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS claims ("
+            "account TEXT NOT NULL, "
+            "offer_id TEXT NOT NULL, "
+            "title TEXT, "
+            "status TEXT NOT NULL, "
+            "claim_code TEXT, "
+            "first_seen REAL NOT NULL, "
+            "updated_at REAL NOT NULL, "
+            "PRIMARY KEY (account, offer_id))"
+        )
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def settled(self, account: str) -> typing.Set[str]:
+        placeholders = ", ".join("?" for _ in FINAL_STATES)
+        rows = self.connection.execute(
+            f"SELECT offer_id FROM claims WHERE account = ? AND status IN ({placeholders})", (account, *FINAL_STATES)
+        )
+        return {offer_id for (offer_id,) in rows}
+
+    def record(self, account: str, outcomes: typing.Iterable[ClaimOutcome]) -> None:
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO claims (account, offer_id, title, status, claim_code, first_seen, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (account, offer_id) DO UPDATE SET "
+                "title = excluded.title, "
+                "status = excluded.status, "
+                "claim_code = COALESCE(excluded.claim_code, claims.claim_code), "
+                "updated_at = excluded.updated_at",
+                [
+                    (account, outcome.offer_id, outcome.title, outcome.status, outcome.claim_code, now, now)
+                    for outcome in outcomes
+                ],
+            )
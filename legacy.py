@@ -1,6 +1,7 @@
 import http.cookiejar as cookiejar
+import collections
+import time
 import traceback
-import json
 import typing
 import logging
 from playwright.sync_api import (
@@ -10,41 +11,114 @@ from playwright.sync_api import (
     Cookie,
     Error,
     Page,
+    Playwright,
+    Response,
 )
+from codes import CodeStore
+from filters import OfferFilter
+from ledger import ClaimLedger
+from request_filter import RequestFilter
+from metrics import metrics
+from profiling import profiler
+from offers import Offer, classify, DIRECT_ENTITLEMENT, EXTERNAL_OFFER
+from scheduler import ClaimOutcome, summarize, ALREADY_CLAIMED, CLAIMED, LINK_REQUIRED, NOT_CLAIMABLE, FAILED
 
 
 log = logging.getLogger()
 
+HOME_URL = "https://gaming.amazon.com/home"
+GRAPHQL_URL = "https://gaming.amazon.com/graphql"
+HOME_QUERIES = ("currentUser", "primeOffers")
+
 
 class AuthException(Exception):
     pass
 
 
+class GraphQLCollector:
+    # page "response" listener keeping the first value of every wanted top level GraphQL field
+    def __init__(self, fields: typing.Iterable[str]):
+        self.fields = set(fields)
+        self.data = {}
+
+    @property
+    def missing(self) -> typing.Set[str]:
+        return self.fields - self.data.keys()
+
+    @property
+    def complete(self) -> bool:
+        return not self.missing
+
+    def __call__(self, response: Response) -> None:
+        if GRAPHQL_URL not in response.url or self.complete:
+            return
+        try:
+            data = response.json().get("data") or {}
+        except Exception:
+            return
+        for field in self.missing & data.keys():
+            self.data[field] = data[field]
+
+
+def launch_browser(playwright: Playwright, use_chrome: bool = True, headless: bool = True) -> Browser:
+    if use_chrome:
+        return playwright.chromium.launch(headless=headless)
+    return playwright.firefox.launch(headless=headless)
+
+
 class PrimeLooter:
-    def __init__(self, cookies, publishers="all", headless=True, use_chrome=True):
+    def __init__(
+        self,
+        cookies,
+        publishers="all",
+        headless=True,
+        use_chrome=True,
+        ledger=None,
+        account=None,
+        external_workers=1,
+        request_filter=None,
+        code_store=None,
+        browser=None,
+    ):
         self.cookies = cookies
         self.publishers = publishers
+        self.offer_filter = OfferFilter.from_lines([publishers] if isinstance(publishers, str) else publishers)
         self.headless = headless
         self.use_chrome = use_chrome
+        self.ledger: ClaimLedger = ledger
+        self.account = account
+        self.external_workers = external_workers
+        self.request_filter: RequestFilter = request_filter
+        self.code_store: CodeStore = code_store
+        self.home_data: typing.Optional[dict] = None
+        # a browser passed in is kept running by its owner, only the context of this account is closed on exit
+        self.browser: Browser = browser
+        self.owns_browser = browser is None
 
     def __enter__(self):
-        self.playwright = sync_playwright()
-
-        if self.use_chrome:
-            self.browser: Browser = self.playwright.start().chromium.launch(headless=self.headless)
-        else:
-            self.browser: Browser = self.playwright.start().firefox.launch(headless=self.headless)
-
-        self.context: BrowserContext = self.browser.new_context()
-        self.context.add_cookies(self.cookies)
+        if self.owns_browser:
+            self.playwright = sync_playwright()
+            self.browser = self._launch(self.playwright.start())
+        self.context: BrowserContext = self._new_context(self.browser)
         self.page: Page = self.context.new_page()
         return self
 
+    def _launch(self, playwright: Playwright) -> Browser:
+        return launch_browser(playwright, self.use_chrome, self.headless)
+
+    def _new_context(self, browser: Browser) -> BrowserContext:
+        context = browser.new_context()
+        context.add_cookies(self.cookies)
+        if self.request_filter is not None:
+            self.request_filter.attach(context)
+        return context
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.page.close()
         self.context.close()
-        self.browser.close()
-        self.playwright.__exit__()
+        if self.owns_browser:
+            self.browser.close()
+            self.playwright.__exit__()
 
     @staticmethod
     def code_to_file(game: str, code: str, instructions: str, seperator_string: str = "") -> None:
@@ -58,74 +132,68 @@ class PrimeLooter:
             return True
         return False
 
+    def load_home(self, timeout: float = 30) -> dict:
+        # a single load of /home already fires every GraphQL query the looter needs (`currentUser` for auth and
+        # `primeOffers` for the offers), so collect them all from that one navigation
+        collector = GraphQLCollector(HOME_QUERIES)
+        self.page.on("response", collector)
+        try:
+            log.debug("load home page")
+            self.page.goto(HOME_URL)
+            deadline = time.monotonic() + timeout
+            while not collector.complete:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise Exception(f"Timed out waiting for {', '.join(collector.missing)} while loading {HOME_URL}")
+                self.page.wait_for_event("response", timeout=remaining * 1000)
+        finally:
+            self.page.remove_listener("response", collector)
+        self.home_data = collector.data
+        return self.home_data
+
     def auth(self) -> None:
-        with self.page.expect_response(
-            lambda response: "https://gaming.amazon.com/graphql" in response.url
-            and "currentUser" in response.json()["data"]
-        ) as response_info:
-            log.debug("get auth info")
-            self.page.goto("https://gaming.amazon.com/home")
-            response = response_info.value.json()["data"]["currentUser"]
-            if not response["isSignedIn"]:
-                raise AuthException("Authentication: Not signed in. (Please recreate the cookie.txt file)")
-            elif not response["isAmazonPrime"]:
-                raise AuthException(
-                    "Authentication: Not a valid Amazon Prime account. "
-                    "(Loot can only be redeemed with an Amazon Prime Membership)"
-                )
-            elif not response["isTwitchPrime"]:
-                raise AuthException(
-                    "Authentication: Not a valid Twitch Prime account. "
-                    "(Loot can only be redeemed with an Amazon Prime "
-                    "subscription and a connected Twitch Prime account)"
-                )
+        log.debug("get auth info")
+        if self.home_data is None:
+            self.load_home()
+        response = self.home_data["currentUser"]
+        if not response["isSignedIn"]:
+            raise AuthException("Authentication: Not signed in. (Please recreate the cookie.txt file)")
+        elif not response["isAmazonPrime"]:
+            raise AuthException(
+                "Authentication: Not a valid Amazon Prime account. "
+                "(Loot can only be redeemed with an Amazon Prime Membership)"
+            )
+        elif not response["isTwitchPrime"]:
+            raise AuthException(
+                "Authentication: Not a valid Twitch Prime account. "
+                "(Loot can only be redeemed with an Amazon Prime "
+                "subscription and a connected Twitch Prime account)"
+            )
 
     def get_offers(self) -> typing.List:
-        with self.page.expect_response(
-            lambda response: "https://gaming.amazon.com/graphql" in response.url
-            and "primeOffers" in response.json()["data"]
-        ) as response_info:
-            log.debug("get offers")
-            self.page.goto("https://gaming.amazon.com/home")
-            return response_info.value.json()["data"]["primeOffers"]
-
-    @staticmethod
-    def check_eligibility(offer: dict) -> bool:
-        if offer["linkedJourney"]:
-            for suboffer in offer["linkedJourney"]["offers"]:
-                if suboffer["self"]["eligibility"]:
-                    if suboffer["self"]["eligibility"]["canClaim"]:
-                        return True
-            return False
-        if offer["self"]:
-            return offer["self"]["eligibility"]["canClaim"]
-        raise Exception(f"Could not check offer eligibility status\n{json.dumps(offer, indent=4)}")
+        log.debug("get offers")
+        if self.home_data is None:
+            self.load_home()
+        return self.home_data["primeOffers"]
 
-    @staticmethod
-    def check_claim_status(offer: dict) -> bool:
-        if offer["linkedJourney"]:
-            for suboffer in offer["linkedJourney"]["offers"]:
-                if suboffer["self"]["eligibility"]:
-                    if suboffer["self"]["eligibility"]["isClaimed"]:
-                        return True
-            return False
-        if offer["self"]:
-            return offer["self"]["eligibility"]["isClaimed"]
-        raise Exception(f"Could not check offer eligibility status\n{json.dumps(offer, indent=4)}")
-
-    def claim_external(self, url, publisher):
+    def claim_external(self, url, publisher, tab: Page = None) -> typing.List[ClaimOutcome]:
+        # claims on `tab` when given (and leaves it open for the next offer), on a page of its own otherwise
         if "loot" not in url:
             log.warning(
                 f"Skipping URL {url}, looks to not be a game URL. "
                 "Please report @github if this appears to be a mistake!"
             )
-            return
-
-        tab = self.context.new_page()
+            return []
+
+        outcomes = []
+        game_name = url
+        started = time.perf_counter()
+        own_tab = tab is None
+        if own_tab:
+            tab = self.context.new_page()
         try:
             with tab.expect_response(
-                lambda response: "https://gaming.amazon.com/graphql" in response.url
-                and "journey" in response.json()["data"]
+                lambda response: GRAPHQL_URL in response.url and "journey" in response.json()["data"]
             ) as response_info:
                 log.debug("get game title")
                 tab.goto(url)
@@ -143,6 +211,7 @@ class PrimeLooter:
                 claim_button = loot_card.query_selector("button[data-a-target=AvailableButton]")
                 if not claim_button:
                     log.warning(f"Could not claim {loot_name} from {game_name} by {publisher} (in-game loot)")
+                    outcomes.append(ClaimOutcome(url, f"{loot_name} ({game_name})", NOT_CLAIMABLE, "in-game loot"))
                     continue
 
                 claim_button.click()
@@ -158,6 +227,8 @@ class PrimeLooter:
 
                 if PrimeLooter.exists(tab, "div.gms-success-modal-container"):
                     log.info(f"Claimed {loot_name} ({game_name})")
+                    outcome = ClaimOutcome(url, f"{loot_name} ({game_name})", CLAIMED, game=game_name)
+                    outcomes.append(outcome)
 
                     if PrimeLooter.exists(tab, "div.get-my-stuff-modal-code-success"):
                         try:
@@ -172,6 +243,11 @@ class PrimeLooter:
                                 tab.query_selector("div[data-a-target=gms-claim-instructions]").inner_text().strip()
                             )
                             PrimeLooter.code_to_file(game_name, code, instructions)
+                            outcome.claim_code = code
+                            if self.code_store is not None:
+                                self.code_store.add(
+                                    self.account or "", game_name, loot_name, code, outcome.title, instructions
+                                )
                         except Exception:
                             log.warning(f"Could not get code for {loot_name} ({game_name}) from {publisher}")
 
@@ -179,8 +255,10 @@ class PrimeLooter:
                     tab, "div[data-a-target=gms-progress-bar]"
                 ):
                     log.warning(f"Could not claim {loot_name} from {game_name} by {publisher} (account not connected)")
+                    outcomes.append(ClaimOutcome(url, f"{loot_name} ({game_name})", LINK_REQUIRED))
                 else:
                     log.warning(f"Could not claim {loot_name} from {game_name} by {publisher} (unknown error)")
+                    outcomes.append(ClaimOutcome(url, f"{loot_name} ({game_name})", FAILED, "unknown error"))
                 if tab.query_selector("button[data-a-target=close-modal-button]"):
                     tab.query_selector("button[data-a-target=close-modal-button]").click()
         except Error as ex:
@@ -190,13 +268,66 @@ class PrimeLooter:
                 f"An error occured ({publisher}/{game_name})! Did they make some changes to the website? "
                 "Please report @github if this happens multiple times."
             )
+            outcomes.append(ClaimOutcome(url, game_name, FAILED, str(ex)))
         finally:
+            if own_tab:
+                tab.close()
+            metrics.observe("claim_external", time.perf_counter() - started)
+        return outcomes
+
+    def claim_external_parallel(self, offers: typing.List[Offer]) -> typing.List[ClaimOutcome]:
+        # Claims on up to `external_workers` pages of this account's context at once. The sync Playwright API runs
+        # every event handler in a fiber of its own that may block on the browser, so each page is served by the
+        # handler of its "page" event while this thread waits on the main page. Only the waits for the browser
+        # overlap, nothing runs in parallel in Python, so the shared state needs no locks.
+        work = collections.deque(offers)
+        outcomes = []
+        slots = min(self.external_workers, len(offers))
+        serving: typing.List[Page] = []
+
+        def serve(tab: Page) -> None:
+            # pages opened by the claims themselves aren't slots
+            if len(serving) >= slots:
+                return
+            serving.append(tab)
+            try:
+                while work:
+                    outcomes.extend(self.claim_external_safely(work.popleft(), tab))
+            finally:
+                serving.remove(tab)
+
+        opened = []
+        self.context.on("page", serve)
+        try:
+            for _ in range(slots):
+                opened.append(self.context.new_page())
+        except Error as ex:
+            log.warning(f"Could only open {len(opened)} of {slots} pages for external claims: {ex}")
+        finally:
+            self.context.remove_listener("page", serve)
+        while serving:
+            self.page.wait_for_timeout(100)
+        for tab in opened:
             tab.close()
+        # whatever no page got to (a page that couldn't be opened) is claimed one by one
+        while work:
+            outcomes.extend(self.claim_external_safely(work.popleft()))
+        return outcomes
+
+    def claim_external_safely(self, offer: Offer, tab: Page = None) -> typing.List[ClaimOutcome]:
+        try:
+            return self.claim_external(offer.external_url, offer.publisher, tab)
+        except Exception as ex:
+            log.error(f"Could not claim {offer.title}: {ex!r}")
+            return [ClaimOutcome(offer.external_url, offer.title, FAILED, repr(ex))]
 
     def claim_direct(self):
-        tab = self.context.new_page()
+        # the main page is still on /home after load_home, only open another tab when it has moved on
+        reuse_page = self.page.url.startswith(HOME_URL)
+        tab = self.page if reuse_page else self.context.new_page()
         try:
-            tab.goto("https://gaming.amazon.com/home")
+            if not reuse_page:
+                tab.goto(HOME_URL)
             tab.wait_for_selector('button[data-type="Game"]').click()
 
             offer_selector = (
@@ -232,38 +363,43 @@ class PrimeLooter:
             log.error(ex)
             traceback.print_tb(ex.__traceback__)
         finally:
-            tab.close()
+            if not reuse_page:
+                tab.close()
 
-    def run(self, dump: bool = False):
-        self.auth()
+    def run(self, dump: bool = False) -> typing.List[ClaimOutcome]:
+        # returns the outcomes of the external claims
+        with metrics.phase("load_home"), profiler.phase("load_home"):
+            self.load_home()
+        with metrics.phase("auth"), profiler.phase("auth"):
+            self.auth()
 
         if dump:
             print(self.page.query_selector("div.home").inner_html())
-        offers = self.get_offers()
-
-        not_claimable_offers = [
-            offer for offer in offers if offer.get("linkedJourney") is None and offer.get("self") is None
-        ]
-        claimed_offers = [
-            offer for offer in offers if offer not in not_claimable_offers and PrimeLooter.check_claim_status(offer)
-        ]
-        external_offers = [
-            offer
-            for offer in offers
-            if offer["deliveryMethod"] == "EXTERNAL_OFFER"
-            and offer not in not_claimable_offers
-            and PrimeLooter.check_eligibility(offer)
-        ]
-        direct_offers = [
-            offer
-            for offer in offers
-            if offer["deliveryMethod"] == "DIRECT_ENTITLEMENT" and PrimeLooter.check_eligibility(offer)
-        ]
+        with metrics.phase("get_offers"), profiler.phase("get_offers"):
+            offers = [Offer.from_prime_offer(offer) for offer in self.get_offers()]
+            if self.ledger is not None:
+                settled = self.ledger.settled(self.account)
+                offers = [offer for offer in offers if offer.id not in settled]
+            buckets = classify(offers)
+
+        not_claimable_offers = buckets.not_claimable + buckets.needs_link
+        claimed_offers = buckets.claimed
+        external_offers = [offer for offer in buckets.claimable if offer.delivery_method == EXTERNAL_OFFER]
+        direct_offers = [offer for offer in buckets.claimable if offer.delivery_method == DIRECT_ENTITLEMENT]
+
+        if self.ledger is not None:
+            # a journey with drops left to claim (now or once they unlock) must not be skipped by later runs
+            outcomes = [
+                ClaimOutcome(offer.id, offer.title, ALREADY_CLAIMED)
+                for offer in claimed_offers
+                if offer.id and offer.fully_claimed
+            ]
+            self.ledger.record(self.account, outcomes)
 
         # list non claimable offers
         msg = "Can not claim these ingame offers:"
         for offer in not_claimable_offers:
-            msg += f"\n    - {offer['title']}"
+            msg += f"\n    - {offer.title}"
         msg = msg[:-1]
         msg += "\n"
         log.info(msg)
@@ -271,7 +407,7 @@ class PrimeLooter:
         # list claimed offers
         msg = "The following offers have been claimed already:"
         for offer in claimed_offers:
-            msg += f"\n    - {offer['title']}"
+            msg += f"\n    - {offer.title}"
         msg = msg[:-1]
         msg += "\n"
         log.info(msg)
@@ -280,31 +416,48 @@ class PrimeLooter:
         if direct_offers:
             msg = "Claiming these direct offers:"
             for offer in direct_offers:
-                msg += f"\n    - {offer['title']}"
+                msg += f"\n    - {offer.title}"
             msg = msg[:-1]
             msg += "\n"
             log.info(msg)
-            self.claim_direct()
+            with metrics.phase("claim_direct"), profiler.phase("claim_direct"):
+                self.claim_direct()
         else:
             log.info("No direct offers to claim\n")
         # filter publishers
-        if "all" not in self.publishers:
-            external_offers = [offer for offer in external_offers if offer["content"]["publisher"] in self.publishers]
+        external_offers, _ = self.offer_filter.split(external_offers)
 
         # claim external offers
         if external_offers:
             msg = "Claiming these external offers:"
             for offer in external_offers:
-                msg += f"\n    - {offer['title']}"
+                msg += f"\n    - {offer.title}"
             msg = msg[:-1]
             msg += "\n"
             log.info(msg)
 
-            for offer in external_offers:
-                self.claim_external(offer["content"]["externalURL"], offer["content"]["publisher"])
+            with profiler.phase("claim_external"):
+                if self.external_workers > 1:
+                    outcomes = self.claim_external_parallel(external_offers)
+                else:
+                    outcomes = []
+                    for offer in external_offers:
+                        outcomes.extend(self.claim_external(offer.external_url, offer.publisher))
+
+            metrics.count_outcomes(outcomes)
+            msg = f"External claim results: {summarize(outcomes)}"
+            for outcome in outcomes:
+                if outcome.claim_code:
+                    msg += f"\n    - {outcome.title}: {outcome.claim_code}"
+            log.info(msg + "\n")
         else:
+            outcomes = []
             log.info("No external offers to claim\n")
 
+        if self.request_filter is not None:
+            log.info(self.request_filter.summary())
+        return outcomes
+
 
 def read_cookiefile(path: str) -> typing.List[Cookie]:
     jar = cookiejar.MozillaCookieJar(path)
@@ -0,0 +1,165 @@
+import atexit
+import concurrent.futures
+import dataclasses
+import logging
+import multiprocessing
+import os
+import typing
+
+from playwright.sync_api import sync_playwright, Browser
+
+from codes import CodeStore
+from ledger import ClaimLedger
+from legacy import launch_browser, read_cookiefile, PrimeLooter, AuthException
+from logs import log_account, forward_worker_logs, setup_worker_logging
+from metrics import metrics
+from request_filter import RequestFilter
+from scheduler import ClaimOutcome, summarize
+
+log = logging.getLogger()
+
+
+@dataclasses.dataclass
+class LegacyOptions:
+    publishers: typing.List[str] = dataclasses.field(default_factory=lambda: ["all"])
+    headless: bool = True
+    use_chrome: bool = False
+    ledger_path: typing.Optional[str] = None
+    code_store_path: typing.Optional[str] = None
+    external_workers: int = 1
+    block_profile: str = "default"
+    allow_hosts: typing.List[str] = dataclasses.field(default_factory=list)
+    block_hosts: typing.List[str] = dataclasses.field(default_factory=list)
+    dump: bool = False
+
+
+@dataclasses.dataclass
+class AccountResult:
+    cookie_file: str
+    outcomes: typing.List[ClaimOutcome]
+    metrics: dict
+    error: typing.Optional[str] = None
+    auth_failed: bool = False
+
+
+# the browser of this worker process, started once by `start_worker` and reused for every account it loots
+worker: typing.Dict[str, typing.Any] = {}
+
+
+def start_worker(options: LegacyOptions, log_queue, log_level: int) -> None:
+    setup_worker_logging(log_queue, log_level)
+    worker["options"] = options
+    worker["playwright"] = sync_playwright().start()
+    atexit.register(stop_worker)
+
+
+def stop_worker() -> None:
+    if worker.get("browser") is not None:
+        worker["browser"].close()
+    worker["playwright"].stop()
+
+
+def warm_browser() -> Browser:
+    # relaunched when the browser crashed or was closed while looting the previous account
+    browser = worker.get("browser")
+    if browser is None or not browser.is_connected():
+        options = worker["options"]
+        log.debug(f"Launching browser in worker process {os.getpid()}")
+        browser = worker["browser"] = launch_browser(worker["playwright"], options.use_chrome, options.headless)
+    return browser
+
+
+def loot_account(cookie_file: str) -> AccountResult:
+    # runs in a worker process, every account gets a fresh context with its own cookies on the warm browser
+    options: LegacyOptions = worker["options"]
+    account = os.path.abspath(cookie_file)
+    log_account.set(account)
+    metrics.start_run()
+    ledger = ClaimLedger(options.ledger_path) if options.ledger_path else None
+    code_store = CodeStore(options.code_store_path) if options.code_store_path else None
+    request_filter = RequestFilter.from_profile(options.block_profile, options.allow_hosts, options.block_hosts)
+    outcomes, error, auth_failed = [], None, False
+    try:
+        with PrimeLooter(
+            read_cookiefile(cookie_file),
+            options.publishers,
+            options.headless,
+            options.use_chrome,
+            ledger,
+            account,
+            options.external_workers,
+            request_filter,
+            code_store,
+            browser=warm_browser(),
+        ) as looter:
+            outcomes = looter.run(options.dump)
+    except AuthException as ex:
+        error, auth_failed = str(ex), True
+    except Exception as ex:
+        error = repr(ex)
+    finally:
+        if ledger is not None:
+            ledger.close()
+        if code_store is not None:
+            code_store.close()
+    return AccountResult(cookie_file, outcomes, metrics.snapshot(), error, auth_failed)
+
+
+class LegacyPool:
+    # Loots legacy accounts on a pool of worker processes. Every worker starts Playwright once and keeps its browser
+    # running for as long as the pool lives (every pass in loop mode), so only a BrowserContext is created per
+    # account. Log records and results of the workers stream back to this process as each account finishes.
+    def __init__(self, options: LegacyOptions, processes: int = 0, accounts: int = 1):
+        self.options = options
+        self.processes = processes or max(1, min(os.cpu_count() or 1, accounts))
+        self.executor: typing.Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self.listener = None
+
+    def __enter__(self):
+        # spawned instead of forked, forking a process that already runs threads (logging, metrics) isn't safe
+        context = multiprocessing.get_context("spawn")
+        log_queue = context.Queue()
+        self.listener = forward_worker_logs(log_queue)
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=context,
+            initializer=start_worker,
+            initargs=(self.options, log_queue, logging.getLogger().level),
+        )
+        log.debug(f"Looting legacy accounts with up to {self.processes} browser processes")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        if self.executor is None:
+            return
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.listener.stop()
+        self.executor = None
+
+    def loot(self, cookie_files: typing.List[str]) -> typing.List[AccountResult]:
+        futures = [self.executor.submit(loot_account, cookie_file) for cookie_file in cookie_files]
+        results = []
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                result = future.result()
+            except concurrent.futures.BrokenExecutor:
+                # a worker died (or couldn't start its browser), start over with a fresh pool on the next pass
+                self.close()
+                self.__enter__()
+                raise
+            results.append(result)
+            metrics.merge(result.metrics)
+            if result.error is not None:
+                log.error(f"Account {result.cookie_file} failed: {result.error}")
+            else:
+                log.info(f"Account {result.cookie_file} done: {summarize(result.outcomes)}")
+
+        auth_failures = [result.cookie_file for result in results if result.auth_failed]
+        if auth_failures:
+            # like a single legacy run, an account that can't log in stops the looter, but only once every other
+            # account has been looted
+            raise AuthException(f"Authentication failed for {', '.join(auth_failures)}")
+        return results
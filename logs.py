@@ -0,0 +1,100 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from logging import LogRecord
+
+# account (cookie file) the current task works for, every async task and thread keeps its own value
+log_account: contextvars.ContextVar[str] = contextvars.ContextVar("log_account", default=None)
+
+# attributes passed with `extra=` that end up in JSON lines
+LOG_FIELDS = ("account", "offer_id", "status", "attempts", "duration", "phase")
+
+LOG_FILE = "primelooter.log"
+
+
+def build_handler_filters(handler: str):
+    def handler_filter(record: LogRecord):
+        if hasattr(record, "block"):
+            if record.block == handler:
+                return False
+        return True
+
+    return handler_filter
+
+
+def add_account(record: LogRecord) -> bool:
+    # runs in the task or thread that logged, before the record is queued
+    if not hasattr(record, "account"):
+        record.account = log_account.get()
+    return True
+
+
+class JsonFormatter(logging.Formatter):
+    # one JSON object per line, with the account, offer id and timings of the record when it has them
+    def format(self, record: LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        for field in LOG_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        return json.dumps(entry)
+
+
+def setup_logging(
+    log_file: str = LOG_FILE, json_lines: bool = False, level: int = logging.INFO
+) -> logging.handlers.QueueListener:
+    # Records are only put on a queue by whoever logs (event loop, browser threads); a listener thread does the
+    # console and file writes. The `block` attribute of a record still keeps it off the console or the file.
+    if json_lines:
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter("{asctime} [{levelname}] {message}", datefmt="%Y-%m-%d %H:%M:%S", style="{")
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.addFilter(build_handler_filters("console"))
+    file_handler = logging.FileHandler(log_file)
+    file_handler.addFilter(build_handler_filters("file"))
+    for handler in (stream_handler, file_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(add_account)
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    # flushes whatever is still queued when the process exits
+    atexit.register(listener.stop)
+    return listener
+
+
+class ForwardHandler(logging.Handler):
+    # hands records from worker processes to the logger they were logged with in this process
+    def emit(self, record: LogRecord) -> None:
+        logging.getLogger(record.name).handle(record)
+
+
+def forward_worker_logs(log_queue) -> logging.handlers.QueueListener:
+    listener = logging.handlers.QueueListener(log_queue, ForwardHandler())
+    listener.start()
+    return listener
+
+
+def setup_worker_logging(log_queue, level: int) -> None:
+    # worker processes send every record to the parent, which writes them with its own handlers
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(add_account)
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
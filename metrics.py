@@ -0,0 +1,185 @@
+import contextlib
+import copy
+import http.server
+import json
+import os
+import threading
+import time
+import typing
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf"))
+
+
+class Histogram:
+    def __init__(self, buckets: typing.Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def merge(self, other: "Histogram") -> None:
+        self.sum += other.sum
+        self.count += other.count
+        self.counts = [count + other_count for count, other_count in zip(self.counts, other.counts)]
+
+    def cumulative(self) -> typing.List[typing.Tuple[float, int]]:
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class RunMetrics:
+    # Timings, byte counts and claim outcomes of one run (one pass over all accounts). Phases are free-form names,
+    # the API path uses `csrf`, `offers`, `claim` and `account`, the legacy path `load_home`, `auth`, `get_offers`,
+    # `claim_direct` and `claim_external`. Thread safe, legacy external claims report from worker threads.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_run()
+        self.last_prometheus = ""
+
+    def start_run(self) -> None:
+        with self.lock:
+            self.started = time.time()
+            self.finished = None
+            self.phases: typing.Dict[str, Histogram] = {}
+            self.bytes: typing.Dict[typing.Tuple[str, str], int] = {}
+            self.outcomes: typing.Dict[str, int] = {}
+
+    def finish_run(self) -> None:
+        self.finished = time.time()
+        self.last_prometheus = self.to_prometheus()
+
+    def observe(self, phase: str, seconds: float) -> None:
+        with self.lock:
+            self.phases.setdefault(phase, Histogram()).observe(seconds)
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def count_bytes(self, phase: str, sent: int = 0, received: int = 0) -> None:
+        with self.lock:
+            for direction, count in (("sent", sent), ("received", received)):
+                if count:
+                    self.bytes[(phase, direction)] = self.bytes.get((phase, direction), 0) + count
+
+    def count_outcomes(self, outcomes: typing.Iterable) -> None:
+        with self.lock:
+            for outcome in outcomes:
+                self.outcomes[outcome.status] = self.outcomes.get(outcome.status, 0) + 1
+
+    def snapshot(self) -> dict:
+        # picklable copy of what was recorded so far, for handing the metrics of a worker process to the parent
+        with self.lock:
+            return {"phases": copy.deepcopy(self.phases), "bytes": dict(self.bytes), "outcomes": dict(self.outcomes)}
+
+    def merge(self, snapshot: dict) -> None:
+        with self.lock:
+            for phase, histogram in snapshot["phases"].items():
+                self.phases.setdefault(phase, Histogram(histogram.buckets)).merge(histogram)
+            for key, count in snapshot["bytes"].items():
+                self.bytes[key] = self.bytes.get(key, 0) + count
+            for status, count in snapshot["outcomes"].items():
+                self.outcomes[status] = self.outcomes.get(status, 0) + count
+
+    def to_json(self) -> dict:
+        with self.lock:
+            return {
+                "started": self.started,
+                "finished": self.finished,
+                "duration": (self.finished or time.time()) - self.started,
+                "phases": {
+                    phase: {
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "buckets": {str(bound): count for bound, count in histogram.cumulative()},
+                    }
+                    for phase, histogram in self.phases.items()
+                },
+                "bytes": {f"{phase}_{direction}": count for (phase, direction), count in self.bytes.items()},
+                "outcomes": dict(self.outcomes),
+            }
+
+    def to_prometheus(self) -> str:
+        summary = self.to_json()
+        lines = [
+            "# HELP primelooter_phase_seconds Time spent per run phase.",
+            "# TYPE primelooter_phase_seconds histogram",
+        ]
+        with self.lock:
+            for phase, histogram in sorted(self.phases.items()):
+                for bound, count in histogram.cumulative():
+                    le = "+Inf" if bound == float("inf") else str(bound)
+                    lines.append(f'primelooter_phase_seconds_bucket{{phase="{phase}",le="{le}"}} {count}')
+                lines.append(f'primelooter_phase_seconds_sum{{phase="{phase}"}} {histogram.sum}')
+                lines.append(f'primelooter_phase_seconds_count{{phase="{phase}"}} {histogram.count}')
+
+            lines += [
+                "# HELP primelooter_bytes Bytes sent and received per run phase.",
+                "# TYPE primelooter_bytes gauge",
+            ]
+            for (phase, direction), count in sorted(self.bytes.items()):
+                lines.append(f'primelooter_bytes{{phase="{phase}",direction="{direction}"}} {count}')
+
+            lines += ["# HELP primelooter_claims Claim outcomes of the run.", "# TYPE primelooter_claims gauge"]
+            for status, count in sorted(self.outcomes.items()):
+                lines.append(f'primelooter_claims{{status="{status}"}} {count}')
+
+        lines += [
+            "# HELP primelooter_run_duration_seconds Wall time of the run.",
+            "# TYPE primelooter_run_duration_seconds gauge",
+            f"primelooter_run_duration_seconds {summary['duration']}",
+            "# HELP primelooter_run_finished_timestamp_seconds When the run finished.",
+            "# TYPE primelooter_run_finished_timestamp_seconds gauge",
+            f"primelooter_run_finished_timestamp_seconds {summary['finished'] or 0}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write(self, prometheus_path: str = None, json_path: str = None) -> None:
+        # written to a temporary file first so a textfile collector never reads half a file
+        for path, content in (
+            (prometheus_path, self.last_prometheus),
+            (json_path, json.dumps(self.to_json(), indent=2) if json_path else None),
+        ):
+            if not path:
+                continue
+            with open(path + ".tmp", "w") as f:
+                f.write(content)
+            os.replace(path + ".tmp", path)
+
+
+def start_http_exporter(port: int, host: str = "") -> http.server.ThreadingHTTPServer:
+    # serves the metrics of the last finished run, for setups that scrape instead of reading a textfile
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.last_prometheus.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+metrics = RunMetrics()
@@ -0,0 +1,130 @@
+import typing
+
+DIRECT_ENTITLEMENT = "DIRECT_ENTITLEMENT"
+EXTERNAL_OFFER = "EXTERNAL_OFFER"
+
+
+class Offer:
+    # Flat view of a single offer, parsed once from either the API (`inGameLoot` items) or the legacy web page
+    # (`primeOffers`) payload so that nothing downstream has to walk the nested GraphQL dicts again.
+    __slots__ = (
+        "id",
+        "item_id",
+        "game_id",
+        "title",
+        "publisher",
+        "delivery_method",
+        "external_url",
+        "is_claimed",
+        "fully_claimed",
+        "can_claim",
+        "missing_link",
+        "has_eligibility",
+    )
+
+    def __init__(
+        self,
+        offer_id: str,
+        title: str,
+        publisher: str = None,
+        item_id: str = None,
+        game_id: str = None,
+        delivery_method: str = None,
+        external_url: str = None,
+        is_claimed: bool = False,
+        can_claim: bool = False,
+        missing_link: bool = False,
+        has_eligibility: bool = True,
+        fully_claimed: bool = None,
+    ):
+        self.id = offer_id
+        self.title = title
+        self.publisher = publisher
+        self.item_id = item_id
+        self.game_id = game_id
+        self.delivery_method = delivery_method
+        self.external_url = external_url
+        self.is_claimed = is_claimed
+        # every drop of a linked journey is claimed, not just one of them (the same as is_claimed for other offers)
+        self.fully_claimed = is_claimed if fully_claimed is None else fully_claimed
+        self.can_claim = can_claim
+        self.missing_link = missing_link
+        self.has_eligibility = has_eligibility
+
+    def __repr__(self):
+        return f"Offer({self.id!r}, {self.title!r})"
+
+    @classmethod
+    def from_item(cls, item: dict) -> "Offer":
+        # an `Item` of the OffersContext_Offers_And_Items query
+        offer = item["offers"][0]
+        eligibility = offer["offerSelfConnection"]["eligibility"]
+        game = item["game"]
+        return cls(
+            offer["id"],
+            game["assets"]["title"],
+            game["assets"].get("publisher"),
+            item_id=item.get("id"),
+            game_id=game.get("id"),
+            is_claimed=eligibility["isClaimed"],
+            can_claim=eligibility["canClaim"],
+            missing_link=eligibility.get("missingRequiredAccountLink") is True,
+        )
+
+    @classmethod
+    def from_prime_offer(cls, offer: dict) -> "Offer":
+        # an entry of `primeOffers` as loaded by the web page, a linked journey counts as claimed (or claimable)
+        # as soon as one of its sub offers is
+        has_eligibility = True
+        if offer.get("linkedJourney"):
+            selves = [suboffer.get("self") or {} for suboffer in offer["linkedJourney"]["offers"]]
+            eligibilities = [self_["eligibility"] for self_ in selves if self_.get("eligibility")]
+        elif offer.get("self"):
+            eligibilities = [offer["self"].get("eligibility") or {}]
+        else:
+            has_eligibility = False
+            eligibilities = []
+
+        claimed = [eligibility.get("isClaimed") for eligibility in eligibilities]
+        content = offer.get("content") or {}
+        return cls(
+            offer.get("id"),
+            offer["title"],
+            content.get("publisher"),
+            delivery_method=offer.get("deliveryMethod"),
+            external_url=content.get("externalURL"),
+            is_claimed=any(claimed),
+            can_claim=any(eligibility.get("canClaim") for eligibility in eligibilities),
+            missing_link=any(eligibility.get("missingRequiredAccountLink") for eligibility in eligibilities),
+            has_eligibility=has_eligibility,
+            fully_claimed=bool(claimed) and all(claimed),
+        )
+
+
+class OfferBuckets:
+    __slots__ = ("claimed", "claimable", "needs_link", "not_claimable")
+
+    def __init__(self):
+        self.claimed: typing.List[Offer] = []
+        self.claimable: typing.List[Offer] = []
+        self.needs_link: typing.List[Offer] = []
+        self.not_claimable: typing.List[Offer] = []
+
+
+def classify(offers: typing.Iterable[Offer]) -> OfferBuckets:
+    buckets = OfferBuckets()
+    for offer in offers:
+        if not offer.has_eligibility:
+            buckets.not_claimable.append(offer)
+        elif offer.fully_claimed:
+            buckets.claimed.append(offer)
+        elif offer.can_claim:
+            # a journey with one drop claimed still gets its claimable drops claimed
+            buckets.claimable.append(offer)
+        elif offer.is_claimed:
+            buckets.claimed.append(offer)
+        elif offer.missing_link:
+            buckets.needs_link.append(offer)
+        else:
+            buckets.not_claimable.append(offer)
+    return buckets
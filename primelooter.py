@@ -1,56 +1,81 @@
 import argparse
+import contextlib
+import glob
 import logging
+import os
 import sys
-import asyncio
-import time
 import traceback
-from legacy import read_cookiefile, PrimeLooter, AuthException
-from experiment import primelooter
-from logging import LogRecord
+from codes import CodeStore
+from filters import OfferFilter
+from ledger import ClaimLedger
+from session import SessionCache
+from daemon import LootDaemon
+from metrics import metrics, start_http_exporter
+from experiment import LootOptions
+from service import LooterService
+from logs import log_account, setup_logging, LOG_FILE
+from profiling import profiler
+from queries import registry
+from request_filter import RequestFilter
 
+log = logging.getLogger()
 
-def build_handler_filters(handler: str):
-    def handler_filter(record: LogRecord):
-        if hasattr(record, "block"):
-            if record.block == handler:
-                return False
-        return True
 
-    return handler_filter
+def use_legacy_playwright(
+    cookie_file,
+    publishers,
+    headless,
+    use_chrome=False,
+    ledger_path=None,
+    external_workers=1,
+    request_filter=None,
+    code_store_path=None,
+):
+    # playwright is only imported (and only needs to be installed) when the legacy backend is used
+    from legacy import read_cookiefile, PrimeLooter, AuthException
 
+    log_account.set(os.path.abspath(cookie_file))
+    with profiler.phase("cookies"):
+        cookies = read_cookiefile(cookie_file)
+    ledger = ClaimLedger(ledger_path) if ledger_path else None
+    code_store = CodeStore(code_store_path) if code_store_path else None
+    try:
+        account = os.path.abspath(cookie_file)
+        with PrimeLooter(
+            cookies, publishers, headless, use_chrome, ledger, account, external_workers, request_filter, code_store
+        ) as looter:
+            try:
+                looter.run(dump)
+            except AuthException as ex:
+                log.error(ex)
+                sys.exit(1)
+            except Exception as ex:
+                log.error(ex)
+                traceback.print_tb(ex.__traceback__)
+    finally:
+        if ledger is not None:
+            ledger.close()
+        if code_store is not None:
+            code_store.close()
 
-stream_handler = logging.StreamHandler(sys.stdout)
-stream_handler.addFilter(build_handler_filters("console"))
-file_handler = logging.FileHandler("primelooter.log")
-file_handler.addFilter(build_handler_filters("file"))
 
-logging.basicConfig(
-    level=logging.INFO,
-    # format="%(asctime)s [%(levelname)s] %(msg)s",
-    format="{asctime} [{levelname}] {message}",
-    style="{",
-    datefmt="%Y-%m-%d %H:%M:%S",
-    handlers=[file_handler, stream_handler],
-)
+def read_version() -> str:
+    try:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "version.txt")) as f:
+            return f.read().strip()
+    except OSError:
+        return "unknown"
 
-log = logging.getLogger()
 
+def read_account_list(path: str) -> list:
+    # a directory holds one cookies file per account, anything else is a manifest with one cookies file per line
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, "*.txt")))
 
-def use_legacy_playwright(cookie_file, publishers, headless, use_chrome=False):
-    cookies = read_cookiefile(cookie_file)
-    with PrimeLooter(cookies, publishers, headless, use_chrome) as looter:
-        try:
-            looter.run(dump)
-        except AuthException as ex:
-            log.error(ex)
-            sys.exit(1)
-        except Exception as ex:
-            log.error(ex)
-            traceback.print_tb(ex.__traceback__)
-
-
-def use_experimental_api(cookie_file):
-    asyncio.run(primelooter(cookie_file))
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path) as f:
+        lines = [line.strip() for line in f.readlines()]
+    return [os.path.join(base_dir, line) for line in lines if line and not line.startswith("#")]
 
 
 if __name__ == "__main__":
@@ -80,15 +105,211 @@ if __name__ == "__main__":
         required=False,
         default="cookies.txt",
     )
+    parser.add_argument(
+        "-a",
+        "--accounts",
+        dest="accounts",
+        help="Path to a directory of cookies files or a manifest listing one cookies file per line",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--max-accounts",
+        dest="max_accounts",
+        help="How many accounts to loot at the same time when using --accounts",
+        required=False,
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--claim-concurrency",
+        dest="claim_concurrency",
+        help="How many claim requests may be in flight at once per account",
+        required=False,
+        type=int,
+        default=5,
+    )
+    parser.add_argument(
+        "--claim-rate",
+        dest="claim_rate",
+        help="How many claim requests may be sent per second per account",
+        required=False,
+        type=float,
+        default=2.0,
+    )
+    parser.add_argument(
+        "--claim-batch-size",
+        dest="claim_batch_size",
+        help="How many offers to claim per request (1 sends one request per offer)",
+        required=False,
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--ledger",
+        dest="ledger",
+        help="Path to a SQLite claim ledger, offers settled in earlier runs are skipped",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--code-store",
+        dest="code_store",
+        help="Path to the SQLite store claim codes are saved to, look them up with `python codes.py` (empty disables)",
+        required=False,
+        default="game_codes.db",
+    )
+    parser.add_argument(
+        "--session-cache",
+        dest="session_cache",
+        help="Path to a file caching csrf tokens and refreshed cookies between runs (keep it as private as cookies)",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--session-ttl",
+        dest="session_ttl",
+        help="How many seconds a cached csrf token is reused before the home page is fetched again",
+        required=False,
+        type=float,
+        default=3600,
+    )
+    parser.add_argument(
+        "--page-size",
+        dest="page_size",
+        help="Fetch offers in pages of this size and start claiming while later pages load (0 fetches all at once)",
+        required=False,
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--request-timeout",
+        dest="request_timeout",
+        help="Seconds an API request may take before it is cancelled (reads are retried, claims count as failed)",
+        required=False,
+        type=float,
+        default=30.0,
+    )
+    parser.add_argument(
+        "--run-deadline",
+        dest="run_deadline",
+        help="Seconds an account's run may take in total, claims still open then count as failed (default: no limit)",
+        required=False,
+        type=float,
+        default=None,
+    )
+    parser.add_argument(
+        "--claim-retry-rounds",
+        dest="claim_retry_rounds",
+        help="How often claims whose request failed are tried again at the end of a run",
+        required=False,
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--persisted-queries",
+        dest="persisted_queries",
+        help="Send GraphQL documents as automatic persisted queries once an offer read shows the server supports them",
+        required=False,
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--legacy-workers",
+        dest="legacy_workers",
+        help="How many browser pages claim external offers at the same time in legacy mode",
+        required=False,
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--legacy-processes",
+        dest="legacy_processes",
+        help="How many processes loot legacy accounts, each keeping its browser open between accounts "
+        "(0 uses one per CPU core, at most one per account)",
+        required=False,
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--block-profile",
+        dest="block_profile",
+        help="Which requests the legacy browser drops ('default' drops images, media, fonts and third-party hosts)",
+        required=False,
+        choices=list(RequestFilter.PROFILES),
+        default="default",
+    )
+    parser.add_argument(
+        "--allow-host",
+        dest="allow_hosts",
+        help="Additional host the legacy browser may load from (can be repeated)",
+        required=False,
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "--block-host",
+        dest="block_hosts",
+        help="Additional host the legacy browser must not load from (can be repeated)",
+        required=False,
+        action="append",
+        default=[],
+    )
     parser.add_argument(
         "-l",
         "--loop",
         dest="loop",
-        help="Shall the script loop itself? (Cooldown 24h)",
+        help="Keep running and claim new offers as soon as they show up",
         required=False,
         action="store_true",
         default=False,
     )
+    parser.add_argument(
+        "--poll-interval",
+        dest="poll_interval",
+        help="Seconds between checks for new offers in loop mode",
+        required=False,
+        type=float,
+        default=900,
+    )
+    parser.add_argument(
+        "--poll-jitter",
+        dest="poll_jitter",
+        help="Random fraction the poll interval is stretched or shortened by",
+        required=False,
+        type=float,
+        default=0.2,
+    )
+    parser.add_argument(
+        "--full-pass-interval",
+        dest="full_pass_interval",
+        help="Seconds after which a full claim pass runs in loop mode even if no new offers showed up",
+        required=False,
+        type=float,
+        default=60 * 60 * 24,
+    )
+    parser.add_argument(
+        "--metrics-file",
+        dest="metrics_file",
+        help="Write the metrics of every run to this Prometheus textfile",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--metrics-json",
+        dest="metrics_json",
+        help="Write a JSON summary of every run to this file",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--metrics-port",
+        dest="metrics_port",
+        help="Serve the metrics of the last run for Prometheus on this port",
+        required=False,
+        type=int,
+        default=None,
+    )
     parser.add_argument(
         "--dump",
         dest="dump",
@@ -106,6 +327,31 @@ if __name__ == "__main__":
         action="store_true",
         default=False,
     )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        help="Profile CPU and memory per run phase, pstats files and an allocation report are written next to "
+        "primelooter.log",
+        required=False,
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--profile-top",
+        dest="profile_top",
+        help="How many allocation sites per phase the --profile report lists",
+        required=False,
+        type=int,
+        default=25,
+    )
+    parser.add_argument(
+        "--log-json",
+        dest="log_json",
+        help="Write the log as JSON lines including account, offer id and timings",
+        required=False,
+        action="store_true",
+        default=False,
+    )
     parser.add_argument(
         "-nh",
         "--no-headless",
@@ -117,54 +363,122 @@ if __name__ == "__main__":
     )
 
     arg = vars(parser.parse_args())
+    setup_logging(json_lines=arg["log_json"], level=logging.DEBUG if arg["debug"] else logging.INFO)
+    if arg["profile"]:
+        profiler.enable()
+    registry.reset(persisted=arg["persisted_queries"])
+    log_dir = os.path.dirname(os.path.abspath(LOG_FILE))
+    version = read_version()
 
     with open(arg["publishers"]) as f:
         publishers = f.readlines()
     publishers = [x.strip() for x in publishers]
+    offer_filter = OfferFilter.from_lines(publishers)
     headless = arg["headless"]
     dump = arg["dump"]
     legacy = arg["legacy"]
     cookie_file = arg["cookies"]
-    if arg["debug"]:
-        log.level = logging.DEBUG
+    options = LootOptions(
+        claim_concurrency=arg["claim_concurrency"],
+        claim_rate=arg["claim_rate"],
+        claim_batch_size=arg["claim_batch_size"],
+        ledger_path=arg["ledger"],
+        code_store_path=arg["code_store"],
+        offer_filter=offer_filter,
+        session_cache=SessionCache(arg["session_cache"], arg["session_ttl"]),
+        page_size=arg["page_size"],
+        request_timeout=arg["request_timeout"],
+        run_deadline=arg["run_deadline"],
+        claim_retry_rounds=arg["claim_retry_rounds"],
+    )
+    cookie_files = read_account_list(arg["accounts"]) if arg["accounts"] else [cookie_file]
 
-    while True:
+    def run_pass():
+        metrics.start_run()
         try:
-            log.info("Starting Prime Looter\n")
-            if legacy:
-                log.warning(
-                    "WARNING: The Legacy Playwright tool is no longer supported. "
-                    "The code will be deleted soon as its not feasible for long term maintainence. "
-                    "Please consider using the new experimental API Wrapper and opening PRs for any "
-                    "features missing in the new code versus the old!"
+            loot()
+        finally:
+            metrics.finish_run()
+            metrics.write(arg["metrics_file"], arg["metrics_json"])
+            if arg["profile"]:
+                profiler.write(log_dir, arg["profile_top"], f"Prime Looter {version}, ")
+
+    def loot():
+        log.info("Starting Prime Looter\n")
+        if legacy:
+            log.warning(
+                "WARNING: The Legacy Playwright tool is no longer supported. "
+                "The code will be deleted soon as its not feasible for long term maintainence. "
+                "Please consider using the new experimental API Wrapper and opening PRs for any "
+                "features missing in the new code versus the old!"
+            )
+        if legacy_pool is not None:
+            legacy_pool.loot(cookie_files)
+        elif legacy:
+            for cookie_file in cookie_files:
+                use_legacy_playwright(
+                    cookie_file,
+                    publishers,
+                    headless,
+                    ledger_path=arg["ledger"],
+                    code_store_path=arg["code_store"],
+                    external_workers=arg["legacy_workers"],
+                    request_filter=RequestFilter.from_profile(
+                        arg["block_profile"], arg["allow_hosts"], arg["block_hosts"]
+                    ),
                 )
-                use_legacy_playwright(cookie_file, publishers, headless)
+        else:
+            service.loot(cookie_files)
+        log.info("Finished Looting!\n")
+
+    def fingerprint():
+        # the catalog is the same for every account, so the first one is enough to notice new drops
+        return service.fingerprint(cookie_files[0])
+
+    if arg["metrics_port"]:
+        start_http_exporter(arg["metrics_port"])
+
+    fatal_exceptions = ()
+    legacy_pool = None
+    if legacy:
+        from legacy import AuthException
+
+        fatal_exceptions = (AuthException,)
+        # with several accounts, or passes that repeat in loop mode, browsers are worth keeping warm. profiling
+        # needs the accounts in this process.
+        if (len(cookie_files) > 1 or arg["loop"]) and not arg["profile"]:
+            from legacy_pool import LegacyOptions, LegacyPool
+
+            legacy_options = LegacyOptions(
+                publishers=publishers,
+                headless=headless,
+                ledger_path=arg["ledger"],
+                code_store_path=arg["code_store"],
+                external_workers=arg["legacy_workers"],
+                block_profile=arg["block_profile"],
+                allow_hosts=arg["allow_hosts"],
+                block_hosts=arg["block_hosts"],
+                dump=dump,
+            )
+            legacy_pool = LegacyPool(legacy_options, arg["legacy_processes"], len(cookie_files))
+
+    with LooterService(options, arg["max_accounts"]) as service, legacy_pool or contextlib.nullcontext():
+        try:
+            if arg["loop"]:
+                log.info(f"Loop Enabled, checking for new offers every {arg['poll_interval'] / 60:.0f} minutes.")
+                LootDaemon(
+                    run_pass,
+                    fingerprint,
+                    interval=arg["poll_interval"],
+                    jitter=arg["poll_jitter"],
+                    full_pass_interval=arg["full_pass_interval"],
+                    fatal_exceptions=fatal_exceptions,
+                ).run_forever()
             else:
-                use_experimental_api(cookie_file)
-            log.info("Finished Looting!\n")
-        except AuthException as ex:
+                run_pass()
+        except fatal_exceptions as ex:
             log.error(ex)
             sys.exit(1)
         except Exception as ex:
             log.error(ex)
             traceback.print_tb(ex.__traceback__)
-            time.sleep(60)
-        else:
-            if arg["loop"]:
-                log.info("Loop Enabled, sleeping for 24 hours.")
-                stream_handler.terminator = "\r"
-
-                sleep_time = 60 * 60 * 24
-                for time_slept in range(sleep_time):
-                    m, s = divmod(sleep_time - time_slept, 60)
-                    h, m = divmod(m, 60)
-                    log.info(
-                        f"{h:d}:{m:02d}:{s:02d} till next run...",
-                        extra={"block": "file"},
-                    )
-                    time.sleep(1)
-
-                stream_handler.terminator = "\n"
-
-        if not arg["loop"]:
-            break
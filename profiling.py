@@ -0,0 +1,97 @@
+import contextlib
+import cProfile
+import os
+import threading
+import tracemalloc
+import typing
+
+ALLOCATION_TRACE_FRAMES = 1
+# the profiler's own bookkeeping isn't part of any phase
+IGNORED_TRACES = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__))
+
+
+def take_snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces(IGNORED_TRACES)
+
+
+class PhaseProfiler:
+    # cProfile stats and tracemalloc growth per run phase, only collected after `enable`. The phases of the main
+    # thread form a stack: a nested phase pauses the profile of the phase around it, so every call is counted for
+    # exactly one phase. On the event loop a phase also covers whatever other tasks run while it awaits, with
+    # several accounts at once those are counted for the phase that happens to be on top. Phases on other threads
+    # are not profiled.
+    def __init__(self):
+        self.enabled = False
+        self.thread = None
+        self.stack: typing.List[str] = []
+        self.profiles: typing.Dict[str, cProfile.Profile] = {}
+        self.calls: typing.Dict[str, int] = {}
+        # phase -> allocation site -> [bytes, blocks] still held when the phase ended
+        self.allocations: typing.Dict[str, typing.Dict[str, typing.List[int]]] = {}
+
+    def enable(self) -> None:
+        self.enabled = True
+        self.thread = threading.get_ident()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(ALLOCATION_TRACE_FRAMES)
+
+    def _switch(self, previous: typing.Optional[str], current: typing.Optional[str]) -> None:
+        if previous == current:
+            return
+        if previous is not None:
+            self.profiles[previous].disable()
+        if current is not None:
+            self.profiles.setdefault(current, cProfile.Profile()).enable()
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        if not self.enabled or threading.get_ident() != self.thread:
+            yield
+            return
+
+        before = take_snapshot()
+        top = self.stack[-1] if self.stack else None
+        self.stack.append(name)
+        self._switch(top, name)
+        try:
+            yield
+        finally:
+            # phases of concurrent tasks don't always end in the order they started
+            top = self.stack[-1]
+            last = len(self.stack) - 1 - self.stack[::-1].index(name)
+            del self.stack[last]
+            self._switch(top, self.stack[-1] if self.stack else None)
+            self._record(name, take_snapshot().compare_to(before, "lineno"))
+
+    def _record(self, name: str, differences: typing.List[tracemalloc.StatisticDiff]) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+        sites = self.allocations.setdefault(name, {})
+        for difference in differences:
+            if not difference.size_diff and not difference.count_diff:
+                continue
+            frame = difference.traceback[0]
+            site = sites.setdefault(f"{frame.filename}:{frame.lineno}", [0, 0])
+            site[0] += difference.size_diff
+            site[1] += difference.count_diff
+
+    def allocation_report(self, top: int = 25, title: str = "") -> str:
+        lines = [f"{title}allocations still held at the end of each phase, top {top} sites by size", ""]
+        for name, sites in self.allocations.items():
+            total = sum(size for size, _ in sites.values())
+            lines.append(f"== {name} ({self.calls[name]} times, {total / 1024:+.1f} KiB) ==")
+            ranked = sorted(sites.items(), key=lambda item: abs(item[1][0]), reverse=True)[:top]
+            for site, (size, blocks) in ranked:
+                lines.append(f"  {size / 1024:+10.1f} KiB {blocks:+8d} blocks  {site}")
+            lines.append("")
+        return "\n".join(lines)
+
+    def write(self, directory: str, top: int = 25, title: str = "") -> None:
+        # one pstats file per phase (`python -m pstats <file>` or snakeviz to read them) and one allocation report,
+        # each pass in loop mode overwrites them with the totals so far
+        for name, profile in self.profiles.items():
+            profile.dump_stats(os.path.join(directory, f"primelooter-profile-{name}.pstats"))
+        with open(os.path.join(directory, "primelooter-profile-allocations.txt"), "w") as f:
+            f.write(self.allocation_report(top, title))
+
+
+profiler = PhaseProfiler()
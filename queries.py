@@ -0,0 +1,154 @@
+import hashlib
+import json
+import typing
+
+# errors an automatic persisted query (APQ) request can come back with, as codes or as messages
+PERSISTED_QUERY_NOT_FOUND = ("PERSISTED_QUERY_NOT_FOUND", "PersistedQueryNotFound")
+PERSISTED_QUERY_NOT_SUPPORTED = ("PERSISTED_QUERY_NOT_SUPPORTED", "PersistedQueryNotSupported")
+# bytes one of the errors above (or a "Must provide query string") contains, anything else isn't decoded
+PERSISTED_QUERY_MARKERS = (b"PersistedQuery", b"PERSISTED_QUERY", b"provide query")
+
+ITEM_SELECTION = """
+{
+  id
+  offers { id offerSelfConnection { eligibility { isClaimed canClaim missingRequiredAccountLink } } }
+  game { id assets { title publisher } }
+}
+"""
+OFFERS_QUERY = f"""
+query OffersContext_Offers_And_Items($pageSize: Int) {{
+  inGameLoot: items(collectionType: LOOT, pageSize: $pageSize) {{ items {ITEM_SELECTION} }}
+}}
+"""
+OFFERS_PAGE_QUERY = f"""
+query OffersContext_Offers_And_Items($pageSize: Int, $after: String) {{
+  inGameLoot: items(collectionType: LOOT, pageSize: $pageSize, after: $after) {{
+    items {ITEM_SELECTION}
+    pageInfo {{ hasNextPage endCursor }}
+  }}
+}}
+"""
+FINGERPRINT_QUERY = """
+query OffersContext_Offers_And_Items($pageSize: Int) {
+  inGameLoot: items(collectionType: LOOT, pageSize: $pageSize) { items { offers { id } } }
+}
+"""
+PLACE_ORDERS_SELECTION = "{ error { code } orderInformation { catalogOfferId claimCode } }"
+
+
+def minify(query: str) -> str:
+    # none of the documents contain string literals, so all whitespace can be collapsed
+    return " ".join(query.split())
+
+
+def encode(value) -> str:
+    return json.dumps(value, separators=(",", ":"))
+
+
+class Operation:
+    # A GraphQL document with its sha256 hash and the JSON of its request bodies up to the variables, computed once.
+    # Bodies are sent in one of three forms: the hash alone (APQ), hash and document (registers the document with an
+    # APQ server) and the document alone (for servers without APQ, like before). Only read-only operations may probe
+    # whether the server supports persisted queries at all.
+    __slots__ = ("name", "query", "sha256", "read_only", "registered", "prefixes")
+
+    def __init__(self, name: str, query: str, read_only: bool = True):
+        self.name = name
+        self.read_only = read_only
+        self.query = minify(query)
+        self.sha256 = hashlib.sha256(self.query.encode()).hexdigest()
+        # set once the server answered the document sent along with its hash, from then on the hash is enough
+        self.registered = False
+        persisted = {"persistedQuery": {"version": 1, "sha256Hash": self.sha256}}
+        self.prefixes = {
+            "hash": encode({"operationName": name, "extensions": persisted})[:-1] + ',"variables":',
+            "register": encode({"operationName": name, "extensions": persisted, "query": self.query})[:-1]
+            + ',"variables":',
+            "plain": encode({"operationName": name, "extensions": {}, "query": self.query})[:-1] + ',"variables":',
+        }
+
+    def request(self, variables: dict) -> "GraphQLRequest":
+        return GraphQLRequest(self, variables)
+
+
+class GraphQLRequest:
+    # an operation with its variables, encoded once and reused for retries and every form of the body
+    __slots__ = ("operation", "variables", "bodies")
+
+    def __init__(self, operation: Operation, variables: dict):
+        self.operation = operation
+        self.variables = encode(variables)
+        self.bodies: typing.Dict[str, bytes] = {}
+
+    def body(self, form: str) -> bytes:
+        body = self.bodies.get(form)
+        if body is None:
+            body = self.bodies[form] = (self.operation.prefixes[form] + self.variables + "}").encode()
+        return body
+
+
+class QueryRegistry:
+    # Every GraphQL operation the API path sends, defined once with only the fields that are read. Persisted queries
+    # are opt-in: `persisted` is set from the command line and switched off for the rest of the process as soon as the
+    # server turns out not to support them. `confirmed` is set once a hash-only read showed that it does, until then
+    # claims send the plain document.
+    def __init__(self):
+        self.persisted = False
+        self.confirmed = False
+        self.offers = Operation("OffersContext_Offers_And_Items", OFFERS_QUERY)
+        self.offers_page = Operation("OffersContext_Offers_And_Items", OFFERS_PAGE_QUERY)
+        self.fingerprint = Operation("OffersContext_Offers_And_Items", FINGERPRINT_QUERY)
+        self.place_orders = Operation(
+            "placeOrdersDetailPage",
+            f"mutation placeOrdersDetailPage($input: PlaceOrdersInput!) {{ placeOrders(input: $input) "
+            f"{PLACE_ORDERS_SELECTION} }}",
+            read_only=False,
+        )
+        self.batches: typing.Dict[int, Operation] = {}
+
+    def reset(self, persisted: bool = False) -> None:
+        # back to the state of a fresh process, nothing is known about the server or registered with it
+        self.persisted = persisted
+        self.confirmed = False
+        for operation in (self.offers, self.offers_page, self.fingerprint, self.place_orders, *self.batches.values()):
+            operation.registered = False
+
+    def place_orders_batch(self, size: int) -> Operation:
+        # every offer of a batch gets its own aliased placeOrders mutation, one document per batch size
+        operation = self.batches.get(size)
+        if operation is None:
+            arguments = ", ".join(f"$input{i}: PlaceOrdersInput!" for i in range(size))
+            mutations = " ".join(f"o{i}: placeOrders(input: $input{i}) {PLACE_ORDERS_SELECTION}" for i in range(size))
+            query = f"mutation placeOrdersBatch({arguments}) {{ {mutations} }}"
+            operation = self.batches[size] = Operation("placeOrdersBatch", query, read_only=False)
+        return operation
+
+
+def persisted_query_error(status_code: int, content: bytes) -> typing.Optional[str]:
+    # "not_found" when the server doesn't know the hash (yet), "unsupported" when it can't handle persisted queries
+    # (or wanted the document), None for every other response, errors included: those are the result of the request
+    # and may well come from executing it. The bytes are checked first, a successful offers response is only
+    # decoded once by whoever reads it.
+    if status_code not in (200, 400) or not any(marker in content for marker in PERSISTED_QUERY_MARKERS):
+        return None
+    try:
+        payload = json.loads(content)
+    except ValueError:
+        return None
+    if payload.get("data"):
+        return None
+    for error in payload.get("errors") or []:
+        code = (error.get("extensions") or {}).get("code")
+        message = error.get("message") or ""
+        if code in PERSISTED_QUERY_NOT_FOUND or message in PERSISTED_QUERY_NOT_FOUND:
+            return "not_found"
+        if code in PERSISTED_QUERY_NOT_SUPPORTED or message in PERSISTED_QUERY_NOT_SUPPORTED:
+            return "unsupported"
+        if "must provide query" in message.lower():
+            return "unsupported"
+    return None
+
+
+registry = QueryRegistry()
+offers_request = registry.offers.request({"pageSize": 999})
+fingerprint_request = registry.fingerprint.request({"pageSize": 999})
@@ -0,0 +1,76 @@
+import threading
+import typing
+import urllib.parse
+
+if typing.TYPE_CHECKING:
+    # only used for annotations, this module is imported without playwright installed to list the profiles
+    from playwright.sync_api import BrowserContext, Response, Route
+
+
+class RequestFilter:
+    # page.route handler for a whole BrowserContext. Only the DOM and the GraphQL traffic matter to the looter, so
+    # the default profile aborts images, media and fonts, any host that isn't Amazon's and Amazon's own beacons.
+    # Blocked resources are never downloaded, so their size is unknown; what gets counted is the number of blocked
+    # requests per type and the bytes of the responses that were let through.
+    PROFILES = {
+        "default": {
+            "resource_types": {"image", "media", "font"},
+            "allowed_hosts": {"amazon.com", "media-amazon.com", "ssl-images-amazon.com", "amazon.dev"},
+            "blocked_hosts": {"fls-na.amazon.com", "unagi.amazon.com", "unagi-na.amazon.com"},
+        },
+        "off": {"resource_types": set(), "allowed_hosts": set(), "blocked_hosts": set()},
+    }
+
+    def __init__(self, resource_types=(), allowed_hosts=(), blocked_hosts=()):
+        self.resource_types = set(resource_types)
+        # an empty allowlist lets every host through that isn't blocklisted
+        self.allowed_hosts = set(allowed_hosts)
+        self.blocked_hosts = set(blocked_hosts)
+        self.blocked = {}
+        self.bytes_loaded = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_profile(cls, profile="default", allowed_hosts=(), blocked_hosts=()) -> "RequestFilter":
+        settings = cls.PROFILES[profile]
+        return cls(
+            settings["resource_types"],
+            settings["allowed_hosts"] | set(allowed_hosts),
+            settings["blocked_hosts"] | set(blocked_hosts),
+        )
+
+    @staticmethod
+    def _matches(host: str, hosts: typing.Set[str]) -> bool:
+        return any(host == pattern or host.endswith("." + pattern) for pattern in hosts)
+
+    def is_blocked(self, resource_type: str, url: str) -> bool:
+        host = urllib.parse.urlsplit(url).hostname or ""
+        if resource_type in self.resource_types or self._matches(host, self.blocked_hosts):
+            return True
+        return bool(self.allowed_hosts) and not self._matches(host, self.allowed_hosts)
+
+    def handle(self, route: "Route") -> None:
+        request = route.request
+        if self.is_blocked(request.resource_type, request.url):
+            with self.lock:
+                self.blocked[request.resource_type] = self.blocked.get(request.resource_type, 0) + 1
+            route.abort()
+        else:
+            route.continue_()
+
+    def count_response(self, response: "Response") -> None:
+        length = response.headers.get("content-length")
+        if length and length.isdigit():
+            with self.lock:
+                self.bytes_loaded += int(length)
+
+    def attach(self, context: "BrowserContext") -> None:
+        context.route("**/*", self.handle)
+        context.on("response", self.count_response)
+
+    def summary(self) -> str:
+        blocked = ", ".join(f"{resource_type}: {count}" for resource_type, count in sorted(self.blocked.items()))
+        return (
+            f"Blocked {sum(self.blocked.values())} requests ({blocked or 'none'}), "
+            f"loaded {self.bytes_loaded / 1024:.0f} KiB"
+        )
@@ -0,0 +1,225 @@
+import asyncio
+import dataclasses
+import logging
+import random
+import time
+import typing
+
+import httpx
+
+log = logging.getLogger()
+
+CLAIMED = "claimed"
+ALREADY_CLAIMED = "already_claimed"
+LINK_REQUIRED = "link_required"
+NOT_CLAIMABLE = "not_claimable"
+FILTERED = "filtered"
+FAILED = "failed"
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRY_EXCEPTIONS = (httpx.TransportError, asyncio.TimeoutError)
+# the request never left this machine, so sending a claim again can't place a second order
+UNSENT_EXCEPTIONS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+T = typing.TypeVar("T")
+
+
+def turned_away(response: httpx.Response) -> bool:
+    # the server refused a claim before doing anything with it: throttled, or unavailable and saying when to come back.
+    # a 500/502/504 may come after the order was placed, like a timeout.
+    return response.status_code == 429 or (response.status_code == 503 and "Retry-After" in response.headers)
+
+
+@dataclasses.dataclass
+class ClaimOutcome:
+    offer_id: str
+    title: str
+    status: str
+    error: typing.Optional[str] = None
+    attempts: int = 0
+    claim_code: typing.Optional[str] = None
+    # id (API) or title (legacy browser) of the game the offer belongs to
+    game: typing.Optional[str] = None
+    # the request never reached the server or was turned away (429 or 503 with Retry-After, after all retries),
+    # trying again may well succeed
+    retryable: bool = False
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class RequestFailed(Exception):
+    # a claim request that got no response, `sent` is set when the server may have received it and placed the order
+    def __init__(self, message: str, attempts: int, sent: bool):
+        super().__init__(message)
+        self.attempts = attempts
+        self.sent = sent
+
+
+class Deadline:
+    # Wall clock budget shared by every request of a run, no `seconds` means the run may take as long as it needs.
+    def __init__(self, seconds: float = None):
+        self.expires_at = time.monotonic() + seconds if seconds else None
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return float("inf")
+        return self.expires_at - time.monotonic()
+
+    def timeout(self, limit: float) -> float:
+        # timeout for the next request, shortened when the run is about to run out of time
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("Run deadline exceeded")
+        return min(limit, remaining)
+
+    async def sleep(self, delay: float) -> None:
+        # no point in waiting for a retry that could never be sent
+        if delay >= self.remaining():
+            raise DeadlineExceeded("Run deadline exceeded")
+        await asyncio.sleep(delay)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        # the lock keeps waiters in FIFO order so a burst of claims can't starve the oldest one
+        async with self.lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class ClaimScheduler:
+    # Runs claim requests with bounded concurrency behind a token bucket. When the server answers with a 429 or a
+    # 5xx every pending request is paused, the request rate is halved and the request is retried; successful
+    # requests slowly raise the rate back up to the configured one. Every attempt is cut off after `request_timeout`
+    # seconds and nothing is sent or waited for past the run's `deadline`. Claims aren't idempotent, so a request
+    # is only retried when it never reached the server or was turned away (see `turned_away`), any other 5xx is
+    # returned as it is.
+    def __init__(
+        self,
+        max_concurrency: int = 5,
+        rate: float = 2.0,
+        max_retries: int = 4,
+        base_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        min_rate: float = 0.2,
+        request_timeout: float = 30.0,
+        deadline: Deadline = None,
+    ):
+        self.target_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.bucket = TokenBucket(rate)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.resume_at = 0.0
+        self.request_timeout = request_timeout
+        self.deadline = deadline or Deadline()
+
+    def _backoff_delay(self, attempt: int, response: httpx.Response = None) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff)
+        delay = min(self.base_backoff * 2**attempt, self.max_backoff)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _throttled(self, delay: float) -> None:
+        self.bucket.rate = max(self.min_rate, self.bucket.rate / 2)
+        self.resume_at = max(self.resume_at, time.monotonic() + delay)
+
+    def _succeeded(self) -> None:
+        self.bucket.rate = min(self.target_rate, self.bucket.rate + self.target_rate / 10)
+
+    async def _wait_for_resume(self) -> None:
+        delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            await self.deadline.sleep(delay)
+
+    async def _send(self, send: typing.Callable[[], typing.Awaitable[T]]) -> T:
+        timeout = self.deadline.timeout(self.request_timeout)
+        return await asyncio.wait_for(send(), timeout)
+
+    async def request(
+        self, send: typing.Callable[[], typing.Awaitable[httpx.Response]]
+    ) -> typing.Tuple[httpx.Response, int]:
+        # `send` has to build a new request on every call, it is invoked once per attempt.
+        # returns the last response together with the number of attempts it took, raises RequestFailed when there
+        # was no response.
+        async with self.semaphore:
+            attempt = 0
+            while True:
+                await self._wait_for_resume()
+                await self.bucket.acquire()
+                attempt += 1
+                try:
+                    response = await self._send(send)
+                except UNSENT_EXCEPTIONS as ex:
+                    if attempt > self.max_retries:
+                        raise RequestFailed(repr(ex), attempt, sent=False) from ex
+                    delay = self._backoff_delay(attempt - 1)
+                    log.debug(f"Request failed ({ex!r}), retrying in {delay:.1f}s (attempt {attempt})")
+                    await self.deadline.sleep(delay)
+                    continue
+                except asyncio.TimeoutError as ex:
+                    # the order may have been placed with the response still on its way, sending it again would
+                    # at best lose the claim code of the first one
+                    raise RequestFailed(f"no response within {self.request_timeout}s", attempt, sent=True) from ex
+                except httpx.TransportError as ex:
+                    raise RequestFailed(repr(ex), attempt, sent=True) from ex
+
+                if response.status_code < 500 and response.status_code != 429:
+                    self._succeeded()
+                    return response, attempt
+                if not turned_away(response) or attempt > self.max_retries:
+                    return response, attempt
+
+                delay = self._backoff_delay(attempt - 1, response)
+                log.debug(f"Got HTTP {response.status_code}, backing off for {delay:.1f}s (attempt {attempt})")
+                self._throttled(delay)
+
+    async def fetch(self, fetch: typing.Callable[[], typing.Awaitable[T]]) -> T:
+        # Retries an idempotent read (csrf token, offer pages) with jittered exponential backoff. `fetch` signals a
+        # retryable status code by raising HTTPStatusError. Reads skip the claim queue and the token bucket so the
+        # next offer page isn't stuck behind the claims of the previous one, but they do respect a throttling pause.
+        attempt = 0
+        while True:
+            await self._wait_for_resume()
+            attempt += 1
+            try:
+                return await self._send(fetch)
+            except (httpx.HTTPStatusError, *RETRY_EXCEPTIONS) as ex:
+                response = ex.response if isinstance(ex, httpx.HTTPStatusError) else None
+                if response is not None and response.status_code not in RETRY_STATUS_CODES:
+                    raise
+                if attempt > self.max_retries:
+                    raise
+                delay = self._backoff_delay(attempt - 1, response)
+                log.debug(f"Fetch failed ({ex!r}), retrying in {delay:.1f}s (attempt {attempt})")
+                if response is not None:
+                    self._throttled(delay)
+                else:
+                    await self.deadline.sleep(delay)
+
+
+def summarize(outcomes: typing.Iterable[ClaimOutcome]) -> typing.Dict[str, int]:
+    summary = {}
+    for outcome in outcomes:
+        summary[outcome.status] = summary.get(outcome.status, 0) + 1
+    return summary
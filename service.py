@@ -0,0 +1,54 @@
+import asyncio
+import importlib.util
+import logging
+import typing
+
+import httpx
+
+from experiment import primelooter, primelooter_fleet, offers_fingerprint, LootOptions
+
+log = logging.getLogger()
+
+
+class LooterService:
+    # Owns one event loop and one pooled transport for the whole lifetime of the process, so loop mode only pays
+    # for TLS handshakes and connection setup once instead of on every pass. Every account still gets its own
+    # client on top of the shared transport to keep the cookie jars apart.
+    def __init__(self, options: LootOptions = None, max_accounts: int = 4):
+        self.options = options or LootOptions()
+        self.max_accounts = max_accounts
+        self.loop: typing.Optional[asyncio.AbstractEventLoop] = None
+        self.transport: typing.Optional[httpx.AsyncHTTPTransport] = None
+
+    def __enter__(self):
+        self.loop = asyncio.new_event_loop()
+        http2 = importlib.util.find_spec("h2") is not None
+        log.debug(f"Using HTTP/{'2' if http2 else '1.1'} for the API")
+        limits = httpx.Limits(max_connections=self.max_accounts * 10, max_keepalive_connections=self.max_accounts * 2)
+        self.transport = httpx.AsyncHTTPTransport(http2=http2, limits=limits)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        if self.loop is None:
+            return
+        self.loop.run_until_complete(self.transport.aclose())
+        self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+        self.loop.close()
+        self.loop = None
+
+    def loot(self, cookie_files: typing.List[str]) -> None:
+        if len(cookie_files) == 1:
+            self.loop.run_until_complete(primelooter(cookie_files[0], self.transport, self.options))
+            return
+
+        failures = self.loop.run_until_complete(
+            primelooter_fleet(cookie_files, self.max_accounts, self.transport, self.options)
+        )
+        if failures:
+            log.error(f"{len(failures)} of {len(cookie_files)} accounts failed: {', '.join(failures)}")
+
+    def fingerprint(self, cookie_file: str) -> str:
+        return self.loop.run_until_complete(offers_fingerprint(cookie_file, self.transport, self.options))
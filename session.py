@@ -0,0 +1,123 @@
+import http.cookiejar as cookiejar
+import json
+import logging
+import os
+import re
+import time
+import typing
+
+import httpx
+
+from metrics import metrics
+from scheduler import RETRY_STATUS_CODES
+
+log = logging.getLogger()
+
+home_url = "https://gaming.amazon.com/home"
+csrf_pattern = re.compile(r"name='csrf-key' value='([^']*)'")
+
+
+async def fetch_csrf_token(client: httpx.AsyncClient, headers: dict) -> str:
+    # the token sits near the top of the /home page, so stop downloading the (large) page as soon as it shows up.
+    # only the tail of the previous chunks is kept around in case the token is split over two of them.
+    with metrics.phase("csrf"):
+        async with client.stream("GET", home_url, headers=headers) as response:
+            if response.status_code in RETRY_STATUS_CODES:
+                # raised so the caller can retry, a page without the token for any other reason is final
+                response.raise_for_status()
+            try:
+                buffer = ""
+                async for chunk in response.aiter_text():
+                    buffer += chunk
+                    match = csrf_pattern.search(buffer)
+                    if match:
+                        return match.group(1)
+                    buffer = buffer[-512:]
+            finally:
+                metrics.count_bytes("csrf", received=response.num_bytes_downloaded)
+    raise Exception("Could not find the csrf token on the home page, are the cookies still valid?")
+
+
+def cookie_to_dict(cookie: cookiejar.Cookie) -> dict:
+    return {
+        "name": cookie.name,
+        "value": cookie.value,
+        "domain": cookie.domain,
+        "path": cookie.path,
+        "expires": cookie.expires,
+        "secure": cookie.secure,
+    }
+
+
+def cookie_from_dict(data: dict) -> cookiejar.Cookie:
+    return cookiejar.Cookie(
+        version=0,
+        name=data["name"],
+        value=data["value"],
+        port=None,
+        port_specified=False,
+        domain=data["domain"],
+        domain_specified=data["domain"].startswith("."),
+        domain_initial_dot=data["domain"].startswith("."),
+        path=data["path"],
+        path_specified=True,
+        secure=data["secure"],
+        expires=data["expires"],
+        discard=False,
+        comment=None,
+        comment_url=None,
+        rest={},
+    )
+
+
+class SessionCache:
+    # Keeps the csrf token and the (possibly rotated) cookies of every account between runs, so neither the /home
+    # page nor the cookies file have to be read again until the token is older than `ttl` seconds, the server
+    # rejects it, or the cookies file is replaced. Without a path the cache only lives as long as the process.
+    def __init__(self, path: str = None, ttl: float = 3600):
+        self.path = path
+        self.ttl = ttl
+        self.sessions = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.sessions = json.load(f)
+
+    def token(self, account: str) -> typing.Optional[str]:
+        session = self.sessions.get(account)
+        if session is None or time.time() - session["fetched_at"] > self.ttl:
+            return None
+        return session["csrf_token"]
+
+    def cookies(self, account: str, cookie_file: str) -> typing.Optional[typing.List[cookiejar.Cookie]]:
+        # cookies written by the user after they were cached win over the cached ones
+        session = self.sessions.get(account)
+        if session is None or session["cookie_file_mtime"] != os.path.getmtime(cookie_file):
+            return None
+        return [cookie_from_dict(cookie) for cookie in session["cookies"]]
+
+    def store(self, account: str, cookie_file: str, csrf_token: str, cookies: cookiejar.CookieJar) -> None:
+        # the ttl counts from when a token was first seen, storing the same token again doesn't extend it
+        session = self.sessions.get(account)
+        fetched_at = time.time()
+        if session is not None and session["csrf_token"] == csrf_token:
+            fetched_at = session["fetched_at"]
+        self.sessions[account] = {
+            "csrf_token": csrf_token,
+            "fetched_at": fetched_at,
+            "cookie_file_mtime": os.path.getmtime(cookie_file),
+            "cookies": [cookie_to_dict(cookie) for cookie in cookies],
+        }
+        self.save()
+
+    def invalidate(self, account: str) -> None:
+        session = self.sessions.get(account)
+        if session is not None:
+            session["fetched_at"] = 0
+            session["csrf_token"] = None
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        # the cached cookies are as sensitive as the cookies file itself
+        with open(os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+            json.dump(self.sessions, f)
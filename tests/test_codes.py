@@ -0,0 +1,39 @@
+from codes import CodeStore
+from scheduler import ClaimOutcome, CLAIMED, FAILED
+
+
+def test_flush_counts_new_codes_only(tmp_path):
+    with CodeStore(str(tmp_path / "codes.db")) as store:
+        store.add("account", "game", "a", "CODE-A")
+        store.add("account", "game", "a", "CODE-A")
+        store.add("account", "game", "b", "CODE-B")
+        assert store.flush() == 2
+        store.add("account", "game", "a", "CODE-A")
+        store.add("other account", "game", "a", "CODE-A2")
+        assert store.flush() == 1
+        assert store.flush() == 0
+
+
+def test_a_stored_code_is_never_replaced(tmp_path):
+    path = str(tmp_path / "codes.db")
+    with CodeStore(path) as store:
+        store.add("account", "game", "a", "CODE-A", title="A")
+    # written on close, and kept as it is when the same offer comes back
+    with CodeStore(path) as store:
+        store.add("account", "game", "a", "CODE-OTHER")
+        assert store.flush() == 0
+        assert [row["code"] for row in store.lookup(account="account")] == ["CODE-A"]
+
+
+def test_only_claimed_outcomes_with_a_code_are_stored(tmp_path):
+    with CodeStore(str(tmp_path / "codes.db")) as store:
+        store.add_outcomes(
+            "account",
+            [
+                ClaimOutcome("a", "A", CLAIMED, claim_code="CODE-A", game="game"),
+                ClaimOutcome("b", "B", CLAIMED),
+                ClaimOutcome("c", "C", FAILED, claim_code="CODE-C"),
+            ],
+        )
+        assert store.flush() == 1
+        assert store.lookup(code="CODE-A")[0]["title"] == "A"
@@ -0,0 +1,37 @@
+from daemon import LootDaemon
+
+
+def daemon(*fingerprints):
+    # a daemon whose probes return the given fingerprints in order, None for a failed probe
+    fingerprints = list(fingerprints)
+    passes = []
+
+    def fingerprint():
+        value = fingerprints.pop(0)
+        if value is None:
+            raise Exception("probe failed")
+        return value
+
+    return LootDaemon(lambda: passes.append(1), fingerprint), passes
+
+
+def test_unchanged_offers_run_no_pass():
+    loot_daemon, passes = daemon("a", "a", "a")
+    for _ in range(3):
+        loot_daemon.tick()
+    assert len(passes) == 1
+
+
+def test_changed_offers_run_a_pass():
+    loot_daemon, passes = daemon("a", "a", "b")
+    for _ in range(3):
+        loot_daemon.tick()
+    assert len(passes) == 2
+
+
+def test_first_fingerprint_after_a_failed_probe_is_no_change():
+    loot_daemon, passes = daemon(None, "a", "a", "b")
+    for _ in range(4):
+        loot_daemon.tick()
+    assert len(passes) == 2
+    assert loot_daemon.last_fingerprint == "b"
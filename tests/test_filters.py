@@ -0,0 +1,56 @@
+from filters import OfferFilter
+from offers import Offer
+
+
+def offer(title: str = "Some Game", publisher: str = "Some Publisher", game_id: str = "amzn1.pg.game.1") -> Offer:
+    return Offer("amzn1.pg.offer.1", title, publisher=publisher, game_id=game_id)
+
+
+def wanted(lines, **fields) -> bool:
+    return OfferFilter.from_lines(lines).wanted(offer(**fields))
+
+
+def test_a_plain_line_is_a_publisher():
+    assert wanted(["Some Publisher"])
+    assert not wanted(["Other Publisher"])
+
+
+def test_matching_is_case_insensitive():
+    assert wanted(["some publisher"])
+    assert wanted(["title:SOME game"])
+
+
+def test_fields():
+    assert wanted(["title:Some Game"])
+    assert wanted(["game:amzn1.pg.game.1"])
+    assert not wanted(["title:Some Publisher"])
+
+
+def test_wildcards():
+    assert wanted(["Some*"])
+    assert wanted(["title:Some Gam?"])
+    assert not wanted(["Other*"])
+
+
+def test_wildcard_characters_still_match_literally():
+    assert wanted(["Foo [JP]"], publisher="Foo [JP]")
+    assert wanted(["title:What? *Really*"], title="What? *Really*")
+
+
+def test_excludes_win():
+    assert not wanted(["all", "!Some Publisher"])
+    assert not wanted(["Some Publisher", "!title:Some*"])
+
+
+def test_only_excludes_include_everything_else():
+    assert wanted(["!Other Publisher"])
+    assert not wanted(["!Some Publisher"])
+
+
+def test_no_rules_include_nothing():
+    assert not wanted([])
+    assert not wanted(["# a comment", "", "---"])
+
+
+def test_all():
+    assert wanted(["all"])
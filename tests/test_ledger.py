@@ -0,0 +1,35 @@
+from ledger import ClaimLedger
+from scheduler import ClaimOutcome, CLAIMED, ALREADY_CLAIMED, FAILED
+
+
+def test_only_final_outcomes_are_settled(tmp_path):
+    with ClaimLedger(str(tmp_path / "ledger.db")) as ledger:
+        ledger.record(
+            "account",
+            [
+                ClaimOutcome("a", "A", CLAIMED, claim_code="CODE-A"),
+                ClaimOutcome("b", "B", ALREADY_CLAIMED),
+                ClaimOutcome("c", "C", FAILED, error="HTTP 502"),
+            ],
+        )
+        assert ledger.settled("account") == {"a", "b"}
+        assert ledger.settled("other account") == set()
+
+
+def test_a_later_outcome_settles_an_offer(tmp_path):
+    path = str(tmp_path / "ledger.db")
+    with ClaimLedger(path) as ledger:
+        ledger.record("account", [ClaimOutcome("a", "A", FAILED, error="HTTP 502")])
+        assert ledger.settled("account") == set()
+        ledger.record("account", [ClaimOutcome("a", "A", CLAIMED, claim_code="CODE-A")])
+    # settled offers survive the process
+    with ClaimLedger(path) as ledger:
+        assert ledger.settled("account") == {"a"}
+
+
+def test_a_known_claim_code_is_kept(tmp_path):
+    with ClaimLedger(str(tmp_path / "ledger.db")) as ledger:
+        ledger.record("account", [ClaimOutcome("a", "A", CLAIMED, claim_code="CODE-A")])
+        ledger.record("account", [ClaimOutcome("a", "A", ALREADY_CLAIMED)])
+        rows = list(ledger.connection.execute("SELECT status, claim_code FROM claims"))
+    assert rows == [(ALREADY_CLAIMED, "CODE-A")]
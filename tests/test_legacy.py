@@ -0,0 +1,87 @@
+import pytest
+
+pytest.importorskip("playwright")
+
+from playwright.sync_api import Error  # noqa: E402
+
+from legacy import PrimeLooter  # noqa: E402
+from offers import Offer  # noqa: E402
+from scheduler import ClaimOutcome, CLAIMED, FAILED  # noqa: E402
+
+
+class FakePage:
+    # stands in for a Playwright page, only what claim_external_parallel touches
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def wait_for_timeout(self, timeout):
+        pass
+
+
+class FakeContext:
+    # runs the "page" handlers right away like Playwright runs them in a fiber, `fail_after` pages can't be opened
+    def __init__(self, fail_after: int = None):
+        self.fail_after = fail_after
+        self.handlers = []
+        self.pages = []
+
+    def on(self, event, handler):
+        self.handlers.append(handler)
+
+    def remove_listener(self, event, handler):
+        self.handlers.remove(handler)
+
+    def new_page(self):
+        if self.fail_after is not None and len(self.pages) >= self.fail_after:
+            raise Error("Target closed")
+        page = FakePage()
+        self.pages.append(page)
+        for handler in list(self.handlers):
+            handler(page)
+        return page
+
+
+def looter(context: FakeContext, workers: int = 3):
+    prime_looter = PrimeLooter([], external_workers=workers)
+    prime_looter.context = context
+    prime_looter.page = FakePage()
+    claimed_on = []
+
+    def claim_external(url, publisher, tab=None):
+        claimed_on.append(tab)
+        if url.endswith("/3"):
+            raise KeyError("data")
+        return [ClaimOutcome(url, url, CLAIMED)]
+
+    prime_looter.claim_external = claim_external
+    return prime_looter, claimed_on
+
+
+def offers(count: int):
+    return [Offer(str(i), f"Game {i}", external_url=f"https://gaming.amazon.com/loot/{i}") for i in range(count)]
+
+
+def test_every_offer_is_claimed_once_on_the_opened_pages():
+    prime_looter, claimed_on = looter(FakeContext())
+    outcomes = prime_looter.claim_external_parallel(offers(6))
+    assert sorted(outcome.offer_id for outcome in outcomes) == [offer.external_url for offer in offers(6)]
+    assert all(tab in prime_looter.context.pages for tab in claimed_on)
+    assert all(page.closed for page in prime_looter.context.pages)
+    assert prime_looter.context.handlers == []
+
+
+def test_a_failing_claim_is_reported_and_the_rest_go_on():
+    prime_looter, _ = looter(FakeContext())
+    outcomes = {outcome.offer_id: outcome for outcome in prime_looter.claim_external_parallel(offers(6))}
+    assert outcomes["https://gaming.amazon.com/loot/3"].status == FAILED
+    assert sum(outcome.status == CLAIMED for outcome in outcomes.values()) == 5
+
+
+def test_offers_are_claimed_one_by_one_without_pages():
+    prime_looter, claimed_on = looter(FakeContext(fail_after=0))
+    outcomes = prime_looter.claim_external_parallel(offers(4))
+    assert len(outcomes) == 4
+    assert claimed_on == [None] * 4
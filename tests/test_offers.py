@@ -0,0 +1,43 @@
+from offers import Offer, classify
+
+
+def journey(*drops):
+    # a linked journey of the legacy primeOffers payload, one (isClaimed, canClaim) pair per drop
+    return {
+        "id": "amzn1.pg.offer.journey",
+        "title": "Journey",
+        "deliveryMethod": "EXTERNAL_OFFER",
+        "content": {"publisher": "Publisher", "externalURL": "https://gaming.amazon.com/loot/journey"},
+        "linkedJourney": {
+            "offers": [
+                {"self": {"eligibility": {"isClaimed": claimed, "canClaim": can_claim}}}
+                for claimed, can_claim in drops
+            ]
+        },
+    }
+
+
+def test_partly_claimed_journey_is_claimable():
+    offer = Offer.from_prime_offer(journey((True, False), (False, True)))
+    buckets = classify([offer])
+    assert buckets.claimable == [offer]
+    assert buckets.claimed == []
+    assert not offer.fully_claimed
+
+
+def test_journey_is_claimed_once_every_drop_is():
+    offer = Offer.from_prime_offer(journey((True, False), (True, False)))
+    buckets = classify([offer])
+    assert buckets.claimed == [offer]
+    assert offer.fully_claimed
+
+
+def test_partly_claimed_journey_without_claimable_drops_is_claimed_but_not_settled():
+    offer = Offer.from_prime_offer(journey((True, False), (False, False)))
+    assert classify([offer]).claimed == [offer]
+    assert not offer.fully_claimed
+
+
+def test_claimed_api_offer_is_not_claimed_again():
+    offer = Offer("amzn1.pg.offer.1", "Game", is_claimed=True, can_claim=True)
+    assert classify([offer]).claimed == [offer]
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from bench.run import COOKIES
+from bench.stand_in import StandIn
+from experiment import primelooter, LootOptions
+from queries import registry, persisted_query_error
+from scheduler import CLAIMED
+
+
+@pytest.fixture
+def cookie_file(tmp_path):
+    path = tmp_path / "cookies.txt"
+    path.write_text(COOKIES)
+    return str(path)
+
+
+def loot(cookie_file: str, stand_in: StandIn, persisted: bool, **options):
+    registry.reset(persisted=persisted)
+    try:
+        return asyncio.run(primelooter(cookie_file, stand_in.transport(), LootOptions(claim_rate=1000, **options)))
+    finally:
+        registry.reset()
+
+
+def claimed(outcomes) -> int:
+    return sum(outcome.status == CLAIMED for outcome in outcomes)
+
+
+def test_persisted_queries_are_off_by_default(cookie_file):
+    stand_in = StandIn(20)
+    outcomes = loot(cookie_file, stand_in, persisted=False)
+    assert claimed(outcomes) == len(stand_in.expected_claims())
+    assert stand_in.documents == {}
+
+
+@pytest.mark.parametrize("batch_size", [1, 5])
+def test_persisted_queries_against_a_server_with_apq(cookie_file, batch_size):
+    stand_in = StandIn(20)
+    outcomes = loot(cookie_file, stand_in, persisted=True, claim_batch_size=batch_size)
+    assert claimed(outcomes) == len(stand_in.expected_claims())
+    assert stand_in.check() == {"missing": 0, "unexpected": 0, "duplicates": 0}
+    # the offers read confirmed persisted queries, so the claim documents were registered too
+    assert registry.offers.sha256 in stand_in.documents
+    assert len(stand_in.documents) > 1
+
+
+@pytest.mark.parametrize("mode", ["unsupported", "ignored"])
+@pytest.mark.parametrize("page_size", [0, 5])
+def test_persisted_queries_fall_back_to_plain_documents(cookie_file, mode, page_size):
+    stand_in = StandIn(20, persisted_queries=mode)
+    outcomes = loot(cookie_file, stand_in, persisted=True, page_size=page_size)
+    assert claimed(outcomes) == len(stand_in.expected_claims())
+    assert stand_in.check() == {"missing": 0, "unexpected": 0, "duplicates": 0}
+
+
+def test_claims_never_probe_for_persisted_queries(cookie_file):
+    # a claim sent before any read confirmed persisted queries goes out as the plain document
+    stand_in = StandIn(20, persisted_queries="ignored")
+    seen = []
+    handle = stand_in.handle
+
+    async def record(request):
+        if b"placeOrders" in request.content:
+            seen.append(b'"query"' in request.content)
+        return await handle(request)
+
+    stand_in.handle = record
+    loot(cookie_file, stand_in, persisted=True)
+    assert seen and all(seen)
+
+
+@pytest.mark.parametrize(
+    "status_code, content, expected",
+    [
+        (200, b'{"errors":[{"message":"PersistedQueryNotFound"}]}', "not_found"),
+        (200, b'{"errors":[{"extensions":{"code":"PERSISTED_QUERY_NOT_SUPPORTED"}}]}', "unsupported"),
+        (400, b'{"errors":[{"message":"Must provide query string."}]}', "unsupported"),
+        (400, b'{"errors":[{"message":"Query is required"}]}', None),
+        (200, b'{"data":{"inGameLoot":null}}', None),
+        (502, b"PersistedQueryNotFound", None),
+    ],
+)
+def test_persisted_query_error(status_code, content, expected):
+    assert persisted_query_error(status_code, content) == expected
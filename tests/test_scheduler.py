@@ -0,0 +1,109 @@
+import asyncio
+
+import httpx
+import pytest
+
+from scheduler import ClaimScheduler, Deadline, DeadlineExceeded, RequestFailed
+
+
+def scripted(*answers):
+    # a client whose requests get the given answers in order, a status code or an exception to raise
+    answers = list(answers)
+    sent = []
+
+    async def handle(request: httpx.Request) -> httpx.Response:
+        sent.append(request)
+        answer = answers.pop(0)
+        if isinstance(answer, type) and issubclass(answer, Exception):
+            raise answer("scripted", request=request)
+        if isinstance(answer, tuple):
+            return httpx.Response(answer[0], headers=answer[1])
+        return httpx.Response(answer)
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handle)), sent
+
+
+def claim(scheduler: ClaimScheduler, client: httpx.AsyncClient):
+    async def run():
+        async with client:
+            return await scheduler.request(lambda: client.post("https://gaming.amazon.com/graphql"))
+
+    return asyncio.run(run())
+
+
+def scheduler(**kwargs) -> ClaimScheduler:
+    return ClaimScheduler(rate=1000, base_backoff=0, **kwargs)
+
+
+@pytest.mark.parametrize("answer", [429, (503, {"Retry-After": "0"})])
+def test_claim_turned_away_is_retried(answer):
+    client, sent = scripted(answer, 200)
+    response, attempts = claim(scheduler(), client)
+    assert (response.status_code, attempts, len(sent)) == (200, 2, 2)
+
+
+@pytest.mark.parametrize("status", [500, 502, 503, 504])
+def test_claim_server_error_is_not_retried(status):
+    client, sent = scripted(status, 200)
+    response, attempts = claim(scheduler(), client)
+    assert (response.status_code, attempts, len(sent)) == (status, 1, 1)
+
+
+@pytest.mark.parametrize("error", [httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout])
+def test_claim_that_never_left_is_retried(error):
+    client, sent = scripted(error, 200)
+    response, attempts = claim(scheduler(), client)
+    assert (response.status_code, attempts, len(sent)) == (200, 2, 2)
+
+
+def test_claim_that_never_left_gives_up_unsent():
+    client, _ = scripted(*[httpx.ConnectError] * 3)
+    with pytest.raises(RequestFailed) as failed:
+        claim(scheduler(max_retries=2), client)
+    assert (failed.value.attempts, failed.value.sent) == (3, False)
+
+
+def test_claim_read_timeout_is_not_retried():
+    client, sent = scripted(httpx.ReadTimeout, 200)
+    with pytest.raises(RequestFailed) as failed:
+        claim(scheduler(), client)
+    assert (failed.value.attempts, failed.value.sent, len(sent)) == (1, True, 1)
+
+
+def test_claim_request_timeout_is_not_retried():
+    calls = []
+
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(1)
+
+    with pytest.raises(RequestFailed) as failed:
+        asyncio.run(scheduler(request_timeout=0.01).request(slow))
+    assert (failed.value.sent, len(calls)) == (True, 1)
+
+
+def test_nothing_is_sent_past_the_deadline():
+    client, sent = scripted(200)
+    deadline = Deadline(0.001)
+    asyncio.run(asyncio.sleep(0.01))
+    with pytest.raises(DeadlineExceeded):
+        claim(scheduler(deadline=deadline), client)
+    assert sent == []
+
+
+def test_reads_are_retried_on_server_errors():
+    client, sent = scripted(502, 200)
+
+    async def fetch():
+        async with client:
+
+            async def read():
+                response = await client.get("https://gaming.amazon.com/home")
+                if response.status_code >= 500:
+                    response.raise_for_status()
+                return response
+
+            return await scheduler().fetch(read)
+
+    assert asyncio.run(fetch()).status_code == 200
+    assert len(sent) == 2
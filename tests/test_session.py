@@ -0,0 +1,52 @@
+import asyncio
+
+import httpx
+import pytest
+
+from session import fetch_csrf_token
+
+
+def fetch(*chunks, status_code: int = 200) -> str:
+    # the /home page arrives in the given chunks, `sent` counts how many of them were read
+    sent = []
+
+    async def stream():
+        for chunk in chunks:
+            sent.append(chunk)
+            yield chunk
+
+    async def run():
+        transport = httpx.MockTransport(lambda request: httpx.Response(status_code, content=stream()))
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await fetch_csrf_token(client, {})
+
+    return asyncio.run(run()), len(sent)
+
+
+def test_token_in_one_chunk():
+    assert fetch(b"<html>", b"<input name='csrf-key' value='token' />", b"</html>") == ("token", 2)
+
+
+@pytest.mark.parametrize("split", [1, 10, 22, 26])
+def test_token_split_across_chunks(split):
+    page = b"<script></script>" * 100 + b"<input type='hidden' name='csrf-key' value='the-token' />"
+    cut = page.index(b"<input") + split
+    chunks = [page[:cut], page[cut:], b"<div></div>" * 100]
+    assert fetch(*chunks) == ("the-token", 2)
+
+
+def test_token_split_after_a_long_chunk():
+    # only the tail of earlier chunks is kept, it has to be enough for a token that starts in one of them
+    page = b"x" * 100000 + b"<input name='csrf-key' value='token' />"
+    chunks = [page[:-20], page[-20:]]
+    assert fetch(*chunks) == ("token", 2)
+
+
+def test_missing_token():
+    with pytest.raises(Exception, match="csrf token"):
+        fetch(b"<html>", b"</html>")
+
+
+def test_server_errors_are_raised_for_a_retry():
+    with pytest.raises(httpx.HTTPStatusError):
+        fetch(b"", status_code=503)